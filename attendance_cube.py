@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+import pandas as pd
+import numpy as np
+import date_utils, df_utils, file_utils, report_type, warehouse
+import os, sys
+
+# Current working directory
+CUR_DIR = os.getcwd()
+
+POSITIONS_FILE = CUR_DIR + '/positions.csv'
+
+# Output directory - change to desired location
+OUTPUT_DIR = CUR_DIR + '/output/points/'
+
+DIMENSIONS = ['att_group', 'rank_group', 'position', 'month']
+
+MEASURES = ['points', 'occurrences']
+
+
+def leave_points(actual_leave):
+    """
+    Converts leave taken descriptions such as 'Tardy - 1/2' to points, the
+    way points.get_attendance_from_leave_taken does. Missed punches (MI)
+    and descriptions without points are NaN.
+    """
+    points = actual_leave.astype(str).str.split('-').str[-1].str.strip(' ')
+    points = points.replace('1/2', '0.5').where(points != 'MI')
+    return pd.to_numeric(points, errors='coerce')
+
+
+def build_cells(df_lt, df_emp, positions, df_roles=None):
+    """
+    Aggregates leave taken events to cube cells
+
+    Args:
+        (pandas.DataFrame) df_lt - leave taken data with payroll_number,
+                           date and actual_leave columns
+        (pandas.DataFrame) df_emp - employee list with payroll_number and
+                           position columns
+        (pandas.DataFrame) positions - positions.csv mapping positions to
+                           att_group and rank_group
+        (pandas.DataFrame) df_roles - role history with payroll_number and
+                           role_date columns. If given, only events since
+                           each employee's current role date are counted,
+                           as points.py does; all events are counted if None.
+    Returns:
+        df - Pandas DataFrame with the points and number of occurrences per
+             att_group, rank_group, position and month
+    """
+    events = df_lt[['payroll_number', 'date', 'actual_leave']].copy()
+    events['points'] = leave_points(events['actual_leave'])
+    events = events.dropna(subset=['points'])
+    if df_roles is not None:
+        events = df_utils.match_role_dates(events, df_roles,
+                                           report=report_type.Report_Type.LEAVE_TAKEN)
+    else:
+        events['date'] = date_utils.parse_dates(events['date'],
+                                                report=report_type.Report_Type.LEAVE_TAKEN)
+        events = events.dropna(subset=['date'])
+    events['month'] = events['date'].dt.strftime('%Y-%m')
+
+    if 'position' in df_emp.columns:
+        df_emp = df_utils.latest_per_key(df_emp[['payroll_number', 'position']],
+                                         name='employee list')
+        events = pd.merge(events, df_emp, how='left', on='payroll_number')
+    else:
+        events['position'] = np.nan
+
+    positions = positions[['position', 'att_group', 'rank_group']] \
+        .drop_duplicates('position')
+    events = pd.merge(events, positions, how='left', on='position')
+
+    # Unmapped positions are kept under empty dimension values
+    events[DIMENSIONS] = events[DIMENSIONS].fillna('')
+
+    events['occurrences'] = 1
+    cells = events.groupby(DIMENSIONS, as_index=False)[MEASURES].sum()
+    cells['occurrences'] = cells['occurrences'].astype(int)
+
+    return cells
+
+
+class AttendanceCube:
+    """
+    Attendance points pre-aggregated per att_group, rank_group, position and
+    month, stored in the warehouse next to the snapshots it is built from.
+
+    Leave taken exports overlap, each covering about a year back from the
+    day it was taken. When a new snapshot is added, the months it covers
+    are replaced with its own totals and older months are kept, so every
+    month reflects the newest export that covers it and events are never
+    counted twice. Roll-ups are answered from the cells alone.
+
+    Like points.py, only events since each employee's current role date, as
+    of the snapshot, are counted when demographics are stored. Unlike
+    points.py, events of employees who have since been terminated are kept,
+    so past months do not change as employees leave.
+
+    points.py updates the cube each time it stores new leave taken files;
+    running this module updates it from the warehouse as well.
+
+        cube = AttendanceCube()
+        cube.update()
+        cube.rollup(['att_group'], start='2019-01')
+    """
+
+    def __init__(self, path=warehouse.WAREHOUSE_FILE, positions_path=POSITIONS_FILE):
+        self.wh = warehouse.Warehouse(path)
+        self.conn = self.wh.conn
+        self.positions_path = positions_path
+
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS attendance_cube (
+                                 att_group TEXT,
+                                 rank_group TEXT,
+                                 position TEXT,
+                                 month TEXT,
+                                 points REAL,
+                                 occurrences INTEGER,
+                                 PRIMARY KEY (att_group, rank_group,
+                                              position, month))''')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS attendance_cube_snapshots (
+                                 snapshot_id INTEGER PRIMARY KEY,
+                                 snapshot_date TEXT,
+                                 first_month TEXT)''')
+        self.conn.commit()
+
+    def close(self):
+        self.wh.close()
+
+    def _processed(self):
+        rows = self.conn.execute('SELECT snapshot_id FROM attendance_cube_snapshots')
+        return set(row[0] for row in rows)
+
+    def _months(self):
+        rows = self.conn.execute('SELECT DISTINCT month FROM attendance_cube')
+        return set(row[0] for row in rows)
+
+    def _latest_date(self):
+        row = self.conn.execute('SELECT MAX(snapshot_date) '
+                                'FROM attendance_cube_snapshots').fetchone()
+        return row[0]
+
+    def add_snapshot(self, df_lt, df_emp, positions, snapshot_id=None,
+                     snapshot_date=None, df_roles=None):
+        """
+        Folds one leave taken snapshot into the cube
+
+        The snapshot's first month is usually partial, so it only replaces
+        that month if the cube has no data for it yet; every later month is
+        replaced by the snapshot's totals. A snapshot older than one already
+        in the cube only fills months the cube does not have.
+
+        Args:
+            (pandas.DataFrame) df_lt - leave taken data
+            (pandas.DataFrame) df_emp - employee list giving each employee's
+                               position
+            (pandas.DataFrame) positions - positions.csv mapping
+            (int) snapshot_id - warehouse snapshot id, recorded so the
+                  snapshot is not added again by update()
+            (date) snapshot_date - date the export was taken
+            (pandas.DataFrame) df_roles - role history used to drop events
+                               from before each employee's current role,
+                               see build_cells
+        Returns:
+            int - number of cells written
+        """
+        if snapshot_date is not None:
+            snapshot_date = pd.Timestamp(snapshot_date).strftime('%Y-%m-%d')
+
+        cells = build_cells(df_lt, df_emp, positions, df_roles)
+        first_month = cells['month'].min() if not cells.empty else None
+
+        months = self._months()
+        latest = self._latest_date()
+        if snapshot_date is not None and latest is not None and snapshot_date < latest:
+            cells = cells[~cells['month'].isin(months)]
+        elif first_month in months:
+            cells = cells[cells['month'] > first_month]
+
+        months = cells['month'].unique().tolist()
+        for i in range(0, len(months), warehouse.MAX_PARAMS):
+            chunk = months[i:i + warehouse.MAX_PARAMS]
+            self.conn.execute('DELETE FROM attendance_cube WHERE month IN ({})'
+                              .format(', '.join('?' * len(chunk))), chunk)
+
+        cells[DIMENSIONS + MEASURES].to_sql('attendance_cube', self.conn,
+                                            if_exists='append', index=False)
+
+        if snapshot_id is not None:
+            self.conn.execute('''INSERT OR REPLACE INTO attendance_cube_snapshots
+                                 (snapshot_id, snapshot_date, first_month)
+                                 VALUES (?, ?, ?)''',
+                              (int(snapshot_id), snapshot_date, first_month))
+        self.conn.commit()
+
+        return len(cells)
+
+    def update(self):
+        """
+        Adds the warehouse's leave taken snapshots that are not in the cube
+        yet, oldest first. Each is matched to the newest full employee list
+        and demographics stored on or before its snapshot date.
+
+        Returns:
+            int - number of snapshots added
+        """
+        snaps = self.wh.snapshots(report_type.Report_Type.LEAVE_TAKEN)
+        processed = self._processed()
+        snaps = snaps[~snaps['snapshot_id'].isin(processed)]
+        if snaps.empty:
+            return 0
+
+        positions = df_utils.load_data(self.positions_path)
+
+        for snapshot_id, snapshot_date in zip(snaps['snapshot_id'],
+                                              snaps['snapshot_date']):
+            df_lt = self.wh.load_snapshot(report_type.Report_Type.LEAVE_TAKEN,
+                                          snapshot_id)
+            # rank.py stores its group lists in the same table
+            df_emp = self.wh.as_of(report_type.Report_Type.EMPLOYEE_LIST,
+                                   snapshot_date, group=warehouse.UNGROUPED)
+            df_roles = self.wh.as_of(report_type.Report_Type.DEMOGRAPHICS,
+                                     snapshot_date)
+            if 'role_date' not in df_roles.columns:
+                df_roles = None
+            self.add_snapshot(df_lt, df_emp, positions, snapshot_id,
+                              snapshot_date, df_roles)
+
+        return len(snaps)
+
+    def rollup(self, by=('att_group',), start=None, end=None):
+        """
+        Totals the cube over the given dimensions
+
+        Args:
+            (list) by - dimensions to group by, from DIMENSIONS. An empty
+                  list gives the grand total.
+            (str) start - first month as YYYY-MM, unbounded if None
+            (str) end - last month as YYYY-MM, unbounded if None
+        Returns:
+            df - Pandas DataFrame with the points and occurrences per group
+        """
+        by = list(by)
+        for dim in by:
+            if dim not in DIMENSIONS:
+                raise ValueError('Unknown dimension {}'.format(dim))
+
+        where = []
+        params = []
+        if start is not None:
+            where.append('month >= ?')
+            params.append(start)
+        if end is not None:
+            where.append('month <= ?')
+            params.append(end)
+
+        query = 'SELECT {}SUM(points) AS points, SUM(occurrences) AS occurrences ' \
+                'FROM attendance_cube'.format(''.join(d + ', ' for d in by))
+        if where:
+            query += ' WHERE ' + ' AND '.join(where)
+        if by:
+            query += ' GROUP BY {0} ORDER BY {0}'.format(', '.join(by))
+
+        return pd.read_sql_query(query, self.conn, params=params)
+
+    def pivot(self, by='att_group', measure='points', start=None, end=None):
+        """
+        Returns a measure with one row per value of a dimension and one
+        column per month
+        """
+        df = self.rollup([by, 'month'], start, end)
+        return df.pivot(index=by, columns='month', values=measure).fillna(0)
+
+
+if __name__ == '__main__':
+    by = sys.argv[1] if len(sys.argv) > 1 else 'att_group'
+
+    file_utils.create_dir(OUTPUT_DIR)
+
+    cube = AttendanceCube()
+    print('Added {} leave taken snapshots.'.format(cube.update()))
+
+    df = cube.pivot(by)
+    cube.close()
+
+    print(df)
+
+    filename = OUTPUT_DIR + pd.Timestamp.now().strftime('%Y%m%d%H%M')
+    df.to_csv(filename + '_points_by_{}_and_month.csv'.format(by))
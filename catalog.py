@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+import file_utils
+import hashlib, json, os, zipfile
+import datetime as dt
+
+CATALOG_FILE = '.catalog.json'
+
+CATALOG_VERSION = 2
+
+
+def hash_file(filepath, block_size=1 << 20):
+    """
+    Computes the SHA-1 hash of a file's contents. Archive members and
+    compressed files are hashed by their decompressed contents.
+
+    Args:
+        (str) filepath - path of file to hash
+        (int) block_size - number of bytes read at a time
+    Returns:
+        str - hex digest of the file contents
+    """
+    sha = hashlib.sha1()
+    with file_utils.open_data(filepath) as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class DatasetList(list):
+    """
+    List of Dataset handles with simple queries on their metadata. None of
+    the queries access a dataset's df, so unused files are never parsed.
+    """
+
+    def of_type(self, report_type):
+        return DatasetList(x for x in self if x.df_type == report_type)
+
+    def by_group(self, group):
+        return DatasetList(x for x in self
+                           if getattr(x, 'df_group', None) == group)
+
+    def groups(self):
+        groups = []
+        for x in self:
+            group = getattr(x, 'df_group', None)
+            if group is not None and group not in groups:
+                groups.append(group)
+        return groups
+
+    def newest(self, report_type=None, group=None):
+        """
+        Returns the dataset with the latest snapshot date matching the given
+        report type and group, or None if there is none
+        """
+        matches = self
+        if report_type is not None:
+            matches = matches.of_type(report_type)
+        if group is not None:
+            matches = matches.by_group(group)
+        if not matches:
+            return None
+        return max(matches, key=lambda x: (str(x.snapshot_date or ''),
+                                           x.filepath))
+
+    def loaded(self):
+        return DatasetList(x for x in self if x.loaded)
+
+
+class Catalog:
+    """
+    Persistent catalog of the input files under a directory.
+
+    Each entry records the file's path, size, mtime, content hash, detected
+    report type, snapshot date and group. The catalog is stored as JSON next
+    to the data and only directories whose mtime changed since the last
+    refresh are listed again; files whose size and mtime are unchanged keep
+    their recorded metadata without being opened, unless they have no report
+    type and the Dataset class's rules_mtime() changed since they were
+    detected. Zip archives are catalogued member by member.
+    """
+
+    def __init__(self, directory, extensions='', exclude_dirs=[],
+                 dataset_cls=None, path=None):
+        """
+        Args:
+            (str) directory - root directory of the input files
+            (tuple) extensions - extensions to include, all by default
+            (list) exclude_dirs - directory names pruned from the walk
+            (class) dataset_cls - Dataset class used to detect the report
+                    type and group of new files. Nothing is detected if None.
+            (str) path - catalog file, defaults to .catalog.json in directory
+        """
+        self.directory = directory
+        self.extensions = extensions
+        self.exclude_dirs = exclude_dirs
+        self.dataset_cls = dataset_cls
+        self.path = path or os.path.join(directory, CATALOG_FILE)
+
+        self.dirs = {}
+        self.entries = {}
+
+        # Datasets parsed to identify new files, handed out by datasets()
+        # so those files are not parsed again
+        self._parsed = {}
+
+        self._rules_mtime = None
+
+        self._load()
+
+    def _identifier(self):
+        if self.dataset_cls is None:
+            return None
+        return self.dataset_cls.__module__ + '.' + self.dataset_cls.__name__
+
+    def _rules(self):
+        # mtime of the files a Dataset class identifies files by, if it
+        # declares any
+        rules_mtime = getattr(self.dataset_cls, 'rules_mtime', None)
+        return rules_mtime() if rules_mtime is not None else None
+
+    def _load(self):
+        if not os.path.isfile(self.path):
+            return
+        with open(self.path) as f:
+            data = json.load(f)
+        if data.get('version') != CATALOG_VERSION:
+            return
+        self.dirs = data['dirs']
+        self.entries = data['files']
+
+    def save(self):
+        data = {'version': CATALOG_VERSION,
+                'dirs': self.dirs,
+                'files': self.entries}
+        with open(self.path, 'w') as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+
+    def _include(self, name):
+        return not name.startswith(('~', '.')) and name.endswith(self.extensions)
+
+    def _list_dir(self, directory):
+        subdirs = []
+        files = []
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in self.exclude_dirs:
+                        subdirs.append(entry.path)
+                elif entry.is_file() and self._include(entry.name):
+                    files.append(entry.path)
+        return sorted(subdirs), sorted(files)
+
+    def _identify(self, filepath):
+        if self.dataset_cls is None:
+            return None, None
+        ds = self.dataset_cls(filepath)
+        if ds.df_type is not None:
+            self._parsed[filepath] = ds
+        return ds.df_type, getattr(ds, 'df_group', None)
+
+    def _expand(self, files):
+        # Archives are listed again on every refresh, since rewriting one in
+        # place does not change its directory's mtime
+        expanded = []
+        for filepath in files:
+            if filepath.endswith(file_utils.ZIP_EXT):
+                try:
+                    expanded.extend(file_utils.list_archive(filepath,
+                                                            self.extensions))
+                except (OSError, zipfile.BadZipFile):
+                    continue
+            else:
+                expanded.append(filepath)
+        return expanded
+
+    def _update_file(self, filepath):
+        # Archive members share the size and mtime of their archive, and
+        # fall back to the content hash when it changes
+        st = file_utils.stat_data(filepath)
+        old = self.entries.get(filepath)
+
+        # Report types depend on the Dataset class that detected them, so
+        # entries detected by another class (or none) are detected again
+        identified = old is not None and (self.dataset_cls is None or
+                                          old['identified_by'] == self._identifier())
+
+        # Files of no report type, such as quarantined employee lists, are
+        # detected again when the rules of the Dataset class change
+        if identified and old['report_type'] is None and \
+                old.get('rules_mtime') != self._rules_mtime:
+            identified = False
+
+        if identified and old['size'] == st.st_size and old['mtime'] == st.st_mtime:
+            return old
+
+        file_hash = hash_file(filepath)
+        if identified and old['hash'] == file_hash:
+            old.update(size=st.st_size, mtime=st.st_mtime)
+            return old
+
+        report_type, group = self._identify(filepath)
+        date = file_utils.get_file_date(filepath)
+
+        return {'path': filepath,
+                'size': st.st_size,
+                'mtime': st.st_mtime,
+                'hash': file_hash,
+                'report_type': report_type,
+                'snapshot_date': date.isoformat() if date else None,
+                'group': group,
+                'identified_by': self._identifier(),
+                'rules_mtime': self._rules_mtime}
+
+    def refresh(self):
+        """
+        Brings the catalog up to date with the directory tree and saves it.
+
+        Returns:
+            int - number of directories that were listed again
+        """
+        dirs = {}
+        entries = {}
+        rescanned = 0
+
+        self._rules_mtime = self._rules()
+
+        stack = [self.directory]
+        while stack:
+            directory = stack.pop()
+            try:
+                mtime = os.stat(directory).st_mtime
+            except OSError:
+                continue
+
+            known = self.dirs.get(directory)
+            if known and known['mtime'] == mtime:
+                subdirs, files = known['subdirs'], known['files']
+            else:
+                subdirs, files = self._list_dir(directory)
+                rescanned += 1
+
+            present = []
+            for filepath in files:
+                if os.path.isfile(filepath):
+                    present.append(filepath)
+
+            for filepath in self._expand(present):
+                try:
+                    entries[filepath] = self._update_file(filepath)
+                except (OSError, KeyError):
+                    continue
+
+            dirs[directory] = {'mtime': mtime, 'subdirs': subdirs,
+                               'files': present}
+            stack.extend(subdirs)
+
+        self.dirs = dirs
+        self.entries = entries
+        self.save()
+
+        # Creating the catalog file touches its own directory; record the
+        # new mtime so the next refresh does not list it again
+        catalog_dir = os.path.dirname(self.path)
+        if catalog_dir in self.dirs:
+            self.dirs[catalog_dir]['mtime'] = os.stat(catalog_dir).st_mtime
+            self.save()
+
+        return rescanned
+
+    def query(self, report_type=None, group=None):
+        """
+        Returns catalog entries matching the given report type and group,
+        oldest snapshot first.
+
+        Args:
+            (str) report_type - report type to match, all types if None
+            (str) group - group to match, all groups if None
+        Returns:
+            list(dict) - matching catalog entries
+        """
+        entries = [e for e in self.entries.values()
+                   if (report_type is None or e['report_type'] == report_type)
+                   and (group is None or e['group'] == group)]
+
+        return sorted(entries, key=lambda e: (e['snapshot_date'] or '',
+                                              e['path']))
+
+    def files(self, report_type=None, group=None):
+        return [e['path'] for e in self.query(report_type, group)]
+
+    def datasets(self, report_type=None, group=None):
+        """
+        Returns lazy Dataset handles for the identified catalog entries. The
+        files are only parsed when a handle's df is first accessed, except
+        for files parsed to identify them in this run's refresh, whose
+        datasets are returned as they are.
+
+        Args:
+            (str) report_type - report type to match, all types if None
+            (str) group - group to match, all groups if None
+        Returns:
+            DatasetList - handles ordered oldest snapshot first
+        """
+        datasets = DatasetList()
+        for e in self.query(report_type, group):
+            if e['report_type'] is None:
+                continue
+            date = e['snapshot_date']
+            if date is not None:
+                date = dt.datetime.strptime(date, '%Y-%m-%d').date()
+            ds = self._parsed.pop(e['path'], None)
+            if ds is None:
+                ds = self.dataset_cls(e['path'], df_type=e['report_type'],
+                                      df_group=e['group'], snapshot_date=date)
+            else:
+                ds.snapshot_date = date
+            datasets.append(ds)
+        return datasets
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Single entry point for the employee, points, rank, fml and fml-comp
+scripts.
+
+Only the standard library and the light file_utils and catalog modules are
+imported up front; pandas, numpy and the script modules are imported when a
+subcommand actually runs, so --dry-run and --catalog return immediately.
+--import-times runs the subcommand with Python's -X importtime and reports
+the modules that took longest to import.
+
+    python cli.py rank --dry-run
+    python cli.py points --catalog
+    python cli.py --import-times rank -- --jobs 4
+"""
+import file_utils, catalog
+import argparse, importlib, os, subprocess, sys, time
+
+# Current working directory
+CUR_DIR = os.getcwd()
+
+# Extensions to include in file list
+EXT = (('.xls', '.xlsx', '.csv', '.htm', '.csv.gz', '.htm.gz', '.zip'))
+
+EXCLUDE_DIRS = ['old']
+
+# FML leave types, one input sub directory each, as in fml.py and
+# fml_comp.py
+FML_TYPES = ['blocks', 'intermittent']
+
+# Number of slowest imports listed by --import-times
+IMPORT_REPORT_SIZE = 25
+
+# Script module, configuration file, default input directory and input
+# layout of each subcommand, matching the defaults in the scripts
+# themselves. 'catalog' scripts read every file with an extension in EXT
+# under their input directory; 'fml' scripts read every file of each
+# department directory under their FML_TYPES directories.
+COMMANDS = {'employee': {'module': 'employee',
+                         'conf': CUR_DIR + '/employee.conf',
+                         'in_dir': CUR_DIR + '/data/employee/',
+                         'layout': 'catalog'},
+            'points': {'module': 'points',
+                       'conf': CUR_DIR + '/points.conf',
+                       'in_dir': CUR_DIR + '/data/points/',
+                       'layout': 'catalog'},
+            'rank': {'module': 'rank',
+                     'conf': None,
+                     'in_dir': CUR_DIR + '/data/rank/',
+                     'layout': 'catalog'},
+            'fml': {'module': 'fml',
+                    'conf': None,
+                    'in_dir': CUR_DIR + '/data/fml/',
+                    'layout': 'fml'},
+            'fml-comp': {'module': 'fml_comp',
+                         'conf': None,
+                         'in_dir': CUR_DIR + '/data/fml/',
+                         'layout': 'fml'}}
+
+
+def get_in_dir(command):
+    """
+    Returns the input directory of a subcommand, read from its
+    configuration file when it has one
+    """
+    info = COMMANDS[command]
+    if info['conf'] and os.path.isfile(info['conf']):
+        conf = file_utils.read_conf_file(info['conf'], ['in'])
+        if 'in' in conf:
+            return conf['in']
+    return info['in_dir']
+
+
+def dry_run(command):
+    """
+    Lists the input files a subcommand would process without importing it
+    """
+    in_dir = get_in_dir(command)
+    if not os.path.isdir(in_dir):
+        print('Input directory {} does not exist.'.format(in_dir))
+        return
+
+    skipped = []
+    if COMMANDS[command]['layout'] == 'fml':
+        files = fml_files(in_dir)
+        # fml.py and fml_comp.py skip files without a date in their name
+        skipped = [f for f in files if file_utils.get_file_date(f) is None]
+        files = [f for f in files if f not in skipped]
+    else:
+        files = file_utils.get_files_list(directory=in_dir, extensions=EXT,
+                                          abs_path=True, sub_dirs=True,
+                                          exclude_dirs=EXCLUDE_DIRS)
+        files = [f for f in files if not '/~' in f]
+
+    print('{} would process {} files from {}'.format(command, len(files), in_dir))
+    for f in files:
+        print('  {}'.format(f))
+    for f in skipped:
+        print('  skipped, no date in file name: {}'.format(f))
+
+
+def fml_files(in_dir):
+    """
+    Lists the files fml.py and fml_comp.py compare: every file directly in
+    each department directory of each FML type directory
+    """
+    files = []
+    for fml_type in FML_TYPES:
+        scan_dir = in_dir + fml_type + '/'
+        if not os.path.isdir(scan_dir):
+            continue
+        for department in sorted(file_utils.get_subdirectories(scan_dir)):
+            department_dir = scan_dir + department + '/'
+            files.extend(department_dir + f
+                         for f in sorted(file_utils.get_files_list(department_dir))
+                         if not f.startswith('~'))
+    return files
+
+
+def list_catalog(command):
+    """
+    Prints the catalog entries of a subcommand's input directory as last
+    refreshed, without refreshing it
+    """
+    in_dir = get_in_dir(command)
+    path = os.path.join(in_dir, catalog.CATALOG_FILE)
+    if not os.path.isfile(path):
+        print('No catalog in {}; run {} once to build it.'.format(in_dir, command))
+        return
+
+    cat = catalog.Catalog(in_dir, extensions=EXT, exclude_dirs=EXCLUDE_DIRS)
+    for e in cat.query():
+        print('{:<14} {:<12} {:<20} {}'.format(e['report_type'] or '-',
+                                                e['snapshot_date'] or '-',
+                                                e['group'] or '-',
+                                                e['path']))
+
+
+def run(command, args):
+    """
+    Imports a subcommand's script and runs its main function with the
+    remaining arguments
+    """
+    name = COMMANDS[command]['module']
+    module = importlib.import_module(name)
+
+    sys.argv = [name + '.py'] + args
+    module.main()
+
+
+def run_import_times(argv):
+    """
+    Runs the CLI again in a child interpreter with -X importtime, passing
+    the rest of its error output through, and reports the modules that took
+    longest to import by their own time, excluding the modules they import
+
+    Args:
+        (list) argv - command line arguments without --import-times
+    Returns:
+        int - exit code of the child interpreter
+    """
+    cmd = [sys.executable, '-X', 'importtime', os.path.abspath(__file__)] + argv
+    proc = subprocess.Popen(cmd, stderr=subprocess.PIPE,
+                            universal_newlines=True)
+
+    times = []
+    for line in proc.stderr:
+        if not line.startswith('import time:'):
+            sys.stderr.write(line)
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        if not self_us.strip().isdigit():
+            continue
+        # Nested imports are indented two spaces per level
+        level = (len(name) - len(name.lstrip()) - 1) // 2
+        times.append((name.strip(), int(self_us), int(cumulative_us), level))
+    proc.wait()
+
+    total = sum(t[2] for t in times if t[3] == 0)
+    print('\nImported {} modules in {:.3f} seconds. Slowest:'
+          .format(len(times), total / 1e6))
+    print('{:>10} {:>10}  {}'.format('self', 'cumulative', 'module'))
+    for name, self_us, cumulative_us, level in \
+            sorted(times, key=lambda t: t[1], reverse=True)[:IMPORT_REPORT_SIZE]:
+        print('{:>10.3f} {:>10.3f}  {}'.format(self_us / 1e6,
+                                               cumulative_us / 1e6, name))
+
+    return proc.returncode
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--import-times', action='store_true',
+                        help='report how long each module took to import')
+    parser.add_argument('command', choices=sorted(COMMANDS))
+    parser.add_argument('--dry-run', action='store_true',
+                        help='list the input files without processing them')
+    parser.add_argument('--catalog', action='store_true',
+                        help='list the catalog of the input directory')
+    if argv is None:
+        argv = sys.argv[1:]
+
+    # Arguments after -- are passed on to the script
+    script_args = []
+    if '--' in argv:
+        split = argv.index('--')
+        argv, script_args = argv[:split], argv[split + 1:]
+
+    args = parser.parse_args(argv)
+
+    if args.import_times:
+        argv = [a for a in argv if a != '--import-times']
+        if script_args:
+            argv += ['--'] + script_args
+        sys.exit(run_import_times(argv))
+
+    if args.dry_run:
+        dry_run(args.command)
+    elif args.catalog:
+        list_catalog(args.command)
+    else:
+        run(args.command, script_args)
+
+
+if __name__ == '__main__':
+    start_time = time.perf_counter()
+    main()
+    print('\nTotal time {:.3f} seconds.'.format(time.perf_counter() - start_time), file=sys.stderr)
@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 import df_utils as du
+import date_utils, file_utils
+import mem_profile
 import report_type as rt
-import pandas as pd
 import numpy as np
 
 class Dataset:
@@ -22,17 +23,53 @@ class Dataset:
                     'roles': 'position',
                     'full_time_/_part_time': 'classification'}
 
-    def __init__(self, filepath):
+    def __init__(self, filepath, df_type=None, df_group=None,
+                 snapshot_date=None):
+        """
+        Args:
+            (str) filepath - path of the input file
+            (str) df_type - report type, if already known from the catalog.
+                  The file is then only parsed when df is first accessed.
+            (str) df_group - unused, accepted for compatibility with
+                  vr.Dataset
+            (date) snapshot_date - date the export was taken, if known
+        """
         self.filepath = filepath
-        self.filetype = filepath.split('.')[-1]
+        self.filetype = file_utils.data_name(filepath).split('.')[-1]
 
-        self.df_type = None
+        self.df_type = df_type
+        self.snapshot_date = snapshot_date
 
-        self.df = du.load_data(filepath)
+        self._df = None
+
+        if self.df_type is None:
+            self._load()
+
+    @property
+    def df(self):
+        if self._df is None:
+            self._load()
+        return self._df
+
+    @df.setter
+    def df(self, value):
+        self._df = value
+
+    @property
+    def loaded(self):
+        return self._df is not None
+
+    def _load(self):
+        with mem_profile.stage('load_data', self.filepath):
+            self._df = du.load_data(self.filepath)
         
-        self._identify_data()
+        with mem_profile.stage('identify_data', self.filepath):
+            self._identify_data()
+
+        with mem_profile.stage('format_dataset', self.filepath):
+            self._format_dataset()
 
-        self._format_dataset()
+        mem_profile.track(self.filepath, self._df)
 
     
     def _identify_data(self):
@@ -67,10 +104,12 @@ class Dataset:
         self.df.rename(index=str, columns=self.renamed_cols, inplace=True)
 
         if 'payroll_number' in self.df.columns:
-            self.df['payroll_number'] = self.df['payroll_number'] \
-            .astype(str).apply('{0:0>6}'.format)
+            self.df['payroll_number'] = du.pad_keys(self.df['payroll_number'])
         else:
             self.df['payroll_number'] = self.df['employee_name'].str[1:7]
 
+        du.normalize_text_columns(self.df, keep_other=True)
+
         if 'role_date' in self.df.columns:
-            self.df['role_date'] = pd.to_datetime(self.df['role_date'])
+            self.df['role_date'] = date_utils.parse_dates(self.df['role_date'],
+                                                          report=self.df_type)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+import pandas as pd
+import numpy as np
+import threading
+
+# Date formats of each report's date columns, tried in order before
+# pandas' format inference
+ISO_FORMATS = ['%Y-%m-%d', '%Y-%m-%d %H:%M:%S']
+
+US_FORMATS = ['%m/%d/%Y', '%m/%d/%y', '%m/%d/%Y %H:%M:%S'] + ISO_FORMATS
+
+DATE_FORMATS = {'role_date': {'role_date': US_FORMATS},
+                'demographics': {'role_date': US_FORMATS,
+                                 'termination_date': US_FORMATS,
+                                 'hire_date': US_FORMATS},
+                'leave_taken': {'date': US_FORMATS},
+                'warehouse': {'role_date': ISO_FORMATS,
+                              'date': ISO_FORMATS,
+                              'termination_date': ISO_FORMATS,
+                              'hire_date': ISO_FORMATS}}
+
+# Number of parsed values kept before the cache is cleared
+CACHE_SIZE = 100000
+
+_cache = {}
+
+# Guards _cache, since rank.py's pipelined mode parses files on several
+# threads
+_cache_lock = threading.Lock()
+
+
+def get_formats(report, column):
+    """
+    Returns the declared formats of a report's date column, or an empty
+    list if there are none
+    """
+    return DATE_FORMATS.get(report, {}).get(column, [])
+
+
+def _parse_values(values, formats):
+    parsed = pd.Series(pd.NaT, index=range(len(values)), dtype='datetime64[ns]')
+    text = pd.Series(values, dtype=object).astype(str).str.strip()
+
+    todo = np.ones(len(values), dtype=bool)
+    for fmt in formats:
+        if not todo.any():
+            break
+        result = pd.to_datetime(text[todo], format=fmt, errors='coerce')
+        matched = result.notnull().values
+        parsed.iloc[np.flatnonzero(todo)[matched]] = result[matched].values
+        todo[np.flatnonzero(todo)[matched]] = False
+
+    if todo.any():
+        # Values in none of the declared formats have their format
+        # inferred, as they did before formats were declared
+        rest = pd.Series(np.asarray(values, dtype=object)[todo])
+        parsed.iloc[np.flatnonzero(todo)] = pd.to_datetime(rest).values
+
+    return parsed.values
+
+
+def parse_dates(series, formats=(), report=None, column=None):
+    """
+    Converts a column to datetimes, parsing each distinct value only once.
+
+    The distinct values are parsed with the declared formats, then with
+    format inference for any that match none of them, and the results are
+    mapped back onto the column. Parsed values are cached across calls, so
+    the same dates appearing in several snapshots are parsed once.
+
+    Args:
+        (pandas.Series) series - values to convert
+        (list) formats - formats to try first
+        (str) report - report whose declared formats to use if formats is
+              empty; see DATE_FORMATS
+        (str) column - column whose declared formats to use, the series
+              name by default
+    Returns:
+        pandas.Series - datetime64 values with the series' index
+    """
+    if not formats and report is not None:
+        formats = get_formats(report, column or series.name)
+
+    if series.dtype.kind == 'M':
+        return series
+
+    codes, uniques = pd.factorize(series)
+    if not len(uniques):
+        return pd.to_datetime(series)
+
+    formats = tuple(formats)
+    keys = [(formats, type(v), v) for v in uniques]
+
+    # Results are collected locally, since clearing a full cache also
+    # drops the hits found for this call
+    with _cache_lock:
+        found = {k: _cache[k] for k in keys if k in _cache}
+    missing = [i for i, k in enumerate(keys) if k not in found]
+
+    if missing:
+        parsed = _parse_values(np.asarray(uniques, dtype=object)[missing], formats)
+        parsed = {keys[i]: value for i, value in zip(missing, parsed)}
+        with _cache_lock:
+            if len(_cache) + len(parsed) > CACHE_SIZE:
+                _cache.clear()
+            _cache.update(parsed)
+        found.update(parsed)
+
+    converted = np.array([found[k] for k in keys], dtype='datetime64[ns]')
+    values = np.where(codes >= 0, converted[np.maximum(codes, 0)],
+                      np.datetime64('NaT'))
+
+    return pd.Series(values, index=series.index, name=series.name)
+
+
+def parse_columns(df, report, columns=None):
+    """
+    Converts the declared date columns of a report in place
+
+    Args:
+        (pandas.DataFrame) df - report data
+        (str) report - report type, see DATE_FORMATS
+        (list) columns - columns to convert, all declared columns if None
+    Returns:
+        df - the same Pandas DataFrame
+    """
+    if columns is None:
+        columns = list(DATE_FORMATS.get(report, {}))
+
+    for column in columns:
+        if column in df.columns:
+            df[column] = parse_dates(df[column], report=report, column=column)
+
+    return df
+
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
@@ -1,10 +1,28 @@
 #!/usr/bin/env python3
 import pandas as pd
+import numpy as np
+import date_utils, file_utils, mem_profile
+import io, os, threading
+from collections import namedtuple
+
+RowDiff = namedtuple('RowDiff', ['added', 'removed', 'changed'])
+
+
+def _read_data(source, name):
+    if name.endswith('.csv'):
+        df = pd.read_csv(source)
+    elif name.endswith('.htm'):
+        df = pd.read_html(source, header=0)
+    else:
+        df = pd.read_excel(source)
+    return df
 
 
 def load_data(filepath):
     """
-    Retrieves dataset from specified file
+    Retrieves dataset from specified file. Files ending in .gz and members
+    of zip archives, given as <archive>.zip/<member>, are decompressed
+    while they are read.
 
     Args:
         (str) filename - file path of dataset
@@ -13,13 +31,16 @@ def load_data(filepath):
     """
     print('\nLoading data from {}'.format(filepath))
 
-    if filepath.endswith('.csv'):
-        df = pd.read_csv(filepath)
-    elif filepath.endswith('.htm'):
-        df = pd.read_html(filepath, header=0)
-    else:
-        df = pd.read_excel(filepath)
-    return df
+    name = file_utils.data_name(filepath)
+    if name == os.path.basename(filepath) and \
+            file_utils.split_archive_path(filepath)[1] is None:
+        return _read_data(filepath, name)
+
+    with file_utils.open_data(filepath) as f:
+        if not name.endswith(('.csv', '.htm')):
+            # Excel readers need to seek, which compressed streams do slowly
+            f = io.BytesIO(f.read())
+        return _read_data(f, name)
 
 
 def append_dfs(dfs):
@@ -32,22 +53,173 @@ def append_dfs(dfs):
         df - a single Pandas DataFrame appended together from
              given list of dataframes
     """
-    df_r = pd.DataFrame()
+    with mem_profile.stage('append_dfs'):
+        df_r = pd.DataFrame()
+
+        for df in dfs:
+            df_r = df_r.append(df, sort=False)
 
-    for df in dfs:
-        df_r = df_r.append(df, sort=False)
+        df_r.reset_index(drop=True, inplace=True)
 
-    df_r.reset_index(drop=True, inplace=True)
+    mem_profile.track('append_dfs', df_r)
 
     return df_r
 
+def _normalize_values(series):
+    isnull = series.isnull()
+    if series.dtype.kind in 'biuf':
+        values = series.astype(float).astype(str)
+    else:
+        values = series.astype(str).str.strip()
+    return values.where(~isnull, '')
+
+
+def row_hashes(df, columns=None):
+    """
+    Fingerprints each row of a DataFrame by hashing its normalized values.
+    Numbers are compared as floats, text is stripped and nulls are equal
+    to empty strings.
+
+    Args:
+        (pandas.DataFrame) df - dataframe to fingerprint
+        (list) columns - columns to include, all columns if None
+    Returns:
+        numpy.ndarray - one uint64 hash per row
+    """
+    if columns is None:
+        columns = df.columns.tolist()
+    if not len(df):
+        return np.array([], dtype='uint64')
+
+    normalized = pd.DataFrame({i: _normalize_values(df[c]) if c in df.columns
+                               else pd.Series('', index=df.index)
+                               for i, c in enumerate(columns)})
+
+    return pd.util.hash_pandas_object(normalized, index=False).values
+
+
+def diff_rows(df_old, df_new, columns=None, key=None):
+    """
+    Compares two snapshots of a dataset by row fingerprints. Neither input
+    is modified.
+
+    Without a key, a row is added if no identical row exists in the old
+    snapshot, and removed if no identical row exists in the new one. With
+    a key, rows are matched on the key columns: added and removed hold keys
+    found in only one snapshot, and changed holds the new rows of keys
+    whose values differ.
+
+    Args:
+        (pandas.DataFrame) df_old - previous snapshot
+        (pandas.DataFrame) df_new - current snapshot
+        (list) columns - columns to compare, all of df_new's by default
+        (list) key - columns identifying a record, or None
+    Returns:
+        RowDiff - added, removed and changed Pandas DataFrames
+    """
+    if columns is None:
+        columns = df_new.columns.tolist()
+
+    old_hash = row_hashes(df_old, columns)
+    new_hash = row_hashes(df_new, columns)
+
+    if not key:
+        added = df_new[~np.isin(new_hash, old_hash)]
+        removed = df_old[~np.isin(old_hash, new_hash)]
+        return RowDiff(added, removed, df_new.iloc[0:0])
+
+    old_key = row_hashes(df_old, key)
+    new_key = row_hashes(df_new, key)
+
+    in_old = np.isin(new_key, old_key)
+    added = df_new[~in_old]
+    removed = df_old[~np.isin(old_key, new_key)]
+    changed = df_new[in_old & ~np.isin(new_hash, old_hash)]
+
+    return RowDiff(added, removed, changed)
+
+
 def df_diff(df1, df2, columns=[]):
-    if not columns:
-        columns = df2.columns.tolist()
-    df1['exist'] = 'exist'
-    df = pd.merge(df2, df1, on=columns, how='left')
-    df = df[df['exist'].isnull()].drop('exist', axis=1)
-    df1.drop(columns=['exist'], inplace=True)
+    """
+    Returns the rows of df2 that do not appear in df1, compared on the
+    given columns or all of df2's columns
+    """
+    return diff_rows(df1, df2, columns=columns or None).added
+
+
+def latest_per_key(df, key='payroll_number', order_by=None, name='dataset'):
+    """
+    Collapses a dataset to one row per key before it is joined, so joins
+    stay linear in headcount. The last row of each key is kept, by order_by
+    if given or else in file order, and the number of dropped duplicates is
+    reported.
+
+    Args:
+        (pandas.DataFrame) df - dataset to reduce
+        (str) key - column identifying an employee
+        (list) order_by - columns ordering the rows of a key, oldest first
+        (str) name - dataset name used in the duplicate report
+    Returns:
+        df - Pandas DataFrame with unique key values
+    """
+    if order_by:
+        order_by = [col for col in order_by if col in df.columns]
+    if order_by:
+        df = df.sort_values(by=order_by, kind='mergesort', na_position='first')
+
+    dupes = df.duplicated(subset=[key], keep='last')
+    if dupes.any():
+        print('\nDropped {} older rows of {} duplicated {} values in {}'
+              .format(dupes.sum(), df.loc[dupes, key].nunique(), key, name))
+
+    return df[~dupes]
+
+
+def match_role_dates(df_events, df_roles, key='payroll_number',
+                     date_col='date', role_col='role_date', current_only=True,
+                     report=None):
+    """
+    Matches each event to the employee's role effective date in force on
+    the event date with an as-of join on sorted dates, instead of merging
+    every employee row onto every event.
+
+    Args:
+        (pandas.DataFrame) df_events - events with key and date_col columns
+        (pandas.DataFrame) df_roles - role history with key and role_col
+                           columns; may hold several dates per employee and
+                           duplicate rows
+        (str) key - employee column
+        (str) date_col - event date column
+        (str) role_col - role effective date column
+        (bool) current_only - keep only events on or after the employee's
+               latest role date
+        (str) report - report type whose declared date formats are used to
+              parse date_col, see date_utils.DATE_FORMATS
+    Returns:
+        df - Pandas DataFrame of the matched events with a role_col column.
+             Events before the employee's first role date, or of employees
+             without one, are dropped.
+    """
+    roles = df_roles[[key, role_col]].dropna().drop_duplicates()
+    roles = roles.sort_values(by=role_col)
+
+    events = df_events.copy()
+    events[date_col] = date_utils.parse_dates(events[date_col], report=report)
+    events = events.dropna(subset=[date_col]).sort_values(by=date_col)
+
+    if role_col in events.columns:
+        events = events.drop(columns=[role_col])
+
+    df = pd.merge_asof(events, roles, left_on=date_col, right_on=role_col,
+                       by=key, direction='backward')
+    df = df.dropna(subset=[role_col])
+
+    if current_only:
+        current = roles.groupby(key)[role_col].max()
+        df = df[df[role_col] == df[key].map(current)]
+
+    df.reset_index(drop=True, inplace=True)
+
     return df
 
 
@@ -57,4 +229,133 @@ def normalize_columns(df):
               inplace=True)
 
     return df
-    
\ No newline at end of file
+    
+
+# Number of cleaned text values kept per operation before the cache is
+# cleared
+TEXT_CACHE_SIZE = 100000
+
+_text_cache = {}
+
+# Guards _text_cache, since rank.py's pipelined mode cleans files on
+# several threads
+_text_cache_lock = threading.Lock()
+
+
+def map_unique(series, func, cache_key):
+    """
+    Applies a vectorized function to the distinct values of a column only
+    and maps the results back onto it. Results are cached per cache_key
+    across calls, so values repeated across files are cleaned once.
+
+    Args:
+        (pandas.Series) series - values to transform
+        (function) func - takes a Pandas Series of distinct values and
+                   returns a sequence of the same length
+        (str) cache_key - name of the transformation
+    Returns:
+        pandas.Series - transformed values with the series' index; missing
+                        values stay missing
+    """
+    codes, uniques = pd.factorize(series)
+    uniques = pd.Series(np.asarray(uniques, dtype=object), dtype=object)
+
+    # Values are cached with their type, since 1234 and 1234.0 are equal
+    # keys but format differently
+    keys = [(type(v), v) for v in uniques]
+    with _text_cache_lock:
+        cache = _text_cache.setdefault(cache_key, {})
+        found = {k: cache[k] for k in keys if k in cache}
+
+    missing = np.array([k not in found for k in keys], dtype=bool)
+    if missing.any():
+        todo = uniques[missing]
+        results = dict(zip([k for k, m in zip(keys, missing) if m], func(todo)))
+        with _text_cache_lock:
+            if len(cache) + len(results) > TEXT_CACHE_SIZE:
+                cache.clear()
+            cache.update(results)
+        found.update(results)
+
+    mapped = np.empty(len(uniques) + 1, dtype=object)
+    mapped[:-1] = [found[k] for k in keys]
+    mapped[-1] = np.nan
+
+    return pd.Series(mapped[codes], index=series.index, name=series.name)
+
+
+def normalize_text(series, upper=False, keep_other=False):
+    """
+    Strips surrounding whitespace, and optionally upper-cases, the text of
+    a column
+
+    Args:
+        (pandas.Series) series - values to clean
+        (bool) upper - upper-case the text as well
+        (bool) keep_other - keep values that are not strings. Otherwise
+               they become missing, as with the str accessor.
+    Returns:
+        pandas.Series - cleaned values
+    """
+    def clean(s):
+        out = s.str.upper().str.strip() if upper else s.str.strip()
+        if keep_other:
+            out = out.where(s.map(type) == str, s)
+        return out
+
+    return map_unique(series, clean, 'text:{}:{}'.format(upper, keep_other))
+
+
+def normalize_text_columns(df, upper=False, keep_other=False, exclude=()):
+    """
+    Cleans every text column of a DataFrame with normalize_text
+
+    Args:
+        (pandas.DataFrame) df - dataframe to clean in place
+        (bool) upper - upper-case the text as well
+        (bool) keep_other - keep values that are not strings
+        (list) exclude - columns to leave untouched
+    Returns:
+        df - the same Pandas DataFrame
+    """
+    # StringDtype only exists in newer pandas versions
+    string_dtype = getattr(pd, 'StringDtype', ())
+
+    for column in df.columns:
+        dtype = df[column].dtype
+        if column in exclude or not (dtype == object or
+                                     isinstance(dtype, string_dtype)):
+            continue
+        df[column] = normalize_text(df[column], upper, keep_other)
+
+    return df
+
+
+def split_names(series, sep=', '):
+    """
+    Splits 'Last, First' names into last and first names, once per distinct
+    name. Anything after the first separator is the first name.
+
+    Returns:
+        df - Pandas DataFrame with last_name and first_name columns
+    """
+    def split(s):
+        parts = s.astype(str).str.split(sep, n=1, expand=True) \
+            .reindex(columns=[0, 1])
+        return list(zip(parts[0], parts[1]))
+
+    pairs = map_unique(series, split, 'split_names:' + sep)
+    missing = (np.nan, np.nan)
+
+    return pd.DataFrame([p if isinstance(p, tuple) else missing for p in pairs],
+                        columns=['last_name', 'first_name'], index=series.index)
+
+
+def pad_keys(series, width=6):
+    """
+    Formats ids as strings left-padded with zeros to width, once per
+    distinct id. Missing ids stay missing.
+    """
+    fmt = '{0:0>' + str(width) + '}'
+    return map_unique(series, lambda s: [fmt.format(str(v)) for v in s],
+                      'pad_keys:' + str(width))
@@ -1,8 +1,8 @@
 #!/usr/bin/env python3
 import pandas as pd
 import numpy as np
-import file_utils, df_utils, dataset, report_type
-import os, time
+import file_utils, df_utils, dataset, report_type, warehouse, catalog
+import os, sys, time
 from functools import reduce
 
 # Current working directory
@@ -19,7 +19,7 @@ in_dir = CUR_DIR + '/data/employee/'
 EXCLUDE_DIRS = ['old']
 
 # Extensions to include in file list
-EXT = (('.xls', '.xlsx', '.csv', '.htm'))
+EXT = (('.xls', '.xlsx', '.csv', '.htm', '.csv.gz', '.htm.gz', '.zip'))
 
 # Set pandas to display all columns
 pd.set_option('display.max_columns', None)
@@ -81,25 +81,64 @@ def format_position(df):
     return df
 
 
-def get_employee_info(grouping=None):
-    setup()
-
-    files = file_utils.get_files_list(directory=in_dir, extensions=EXT,
-                                      abs_path=True, sub_dirs=True, exclude_dirs=EXCLUDE_DIRS)
+def load_files():
+    cat = catalog.Catalog(in_dir, extensions=EXT, exclude_dirs=EXCLUDE_DIRS,
+                          dataset_cls=dataset.Dataset)
+    cat.refresh()
 
-    datasets = []
+    datasets = cat.datasets()
 
     start_time = time.time()
-    for f in files:
-        if not '/~' in f:
-            datasets.append(dataset.Dataset(f))
+
+    df_demo = datasets.newest(report_type.Report_Type.DEMOGRAPHICS).df
+
+    df_perf = df_utils.append_dfs([x.df for x in \
+        datasets.of_type(report_type.Report_Type.PERFORMANCE)])
+
+    df_roles = datasets.newest(report_type.Report_Type.EMPLOYEE_LIST).df
 
     print("\nLoading all files took {} seconds.".format(time.time() - start_time))
 
-    df_demo = [x.df for x in datasets \
-        if x.df_type == report_type.Report_Type.DEMOGRAPHICS][0]
+    warehouse.store_datasets(datasets.loaded())
+
+    return df_demo, df_perf, df_roles
+
+
+def load_warehouse(as_of):
+    wh = warehouse.Warehouse()
+
+    df_demo = wh.as_of(report_type.Report_Type.DEMOGRAPHICS, as_of)
+
+    df_perf = wh.as_of(report_type.Report_Type.PERFORMANCE, as_of,
+                       latest_only=False).drop_duplicates()
+
+    # rank.py stores its group lists in the same table
+    df_roles = wh.as_of(report_type.Report_Type.EMPLOYEE_LIST, as_of,
+                        group=warehouse.UNGROUPED)
+
+    wh.close()
+
+    return df_demo, df_perf, df_roles
 
-    tomorrow = pd.to_datetime('today') + pd.DateOffset()
+
+def get_employee_info(grouping=None, as_of=None):
+    """
+    Builds the employee table from the input files, or from the warehouse
+    as it was on a given date
+
+    Args:
+        (str) as_of - date of the query. Loads the current input files if None.
+    Returns:
+        df - Pandas DataFrame with one row per active employee
+    """
+    setup()
+
+    if as_of is None:
+        df_demo, df_perf, df_roles = load_files()
+        tomorrow = pd.to_datetime('today') + pd.DateOffset()
+    else:
+        df_demo, df_perf, df_roles = load_warehouse(as_of)
+        tomorrow = pd.to_datetime(as_of) + pd.DateOffset()
 
     df_demo['termination_date'].fillna(tomorrow, inplace=True)
 
@@ -107,20 +146,23 @@ def get_employee_info(grouping=None):
     
     df_demo = df_demo[['payroll_number', 'last_name', 'first_name', 'classification', 'role_date']]
 
-    df_perf = df_utils.append_dfs([x.df for x in datasets \
-        if x.df_type == report_type.Report_Type.PERFORMANCE])
+    df_demo = df_utils.latest_per_key(df_demo, order_by=['role_date'],
+                                      name='demographics')
 
     df_perf['competency_year'] = df_perf['review_title'].str[:4]
 
     df_perf = df_perf[['payroll_number', 'competency_score', 'competency_year']]
 
+    # Latest review only, so each employee keeps a single row
+    df_perf = df_utils.latest_per_key(df_perf, order_by=['competency_year'],
+                                      name='performance')
+
     df = pd.merge(df_demo, df_perf, how='left', on='payroll_number')
 
-    df_roles = [x.df for x in datasets \
-        if x.df_type == report_type.Report_Type.EMPLOYEE_LIST][0]
-    
     df_roles = df_roles[['payroll_number', 'position', 'skill']]
 
+    df_roles = df_utils.latest_per_key(df_roles, name='employee list')
+
     df = pd.merge(df, df_roles, how='left', on='payroll_number')
 
     df['position'].fillna('', inplace=True)
@@ -135,8 +177,11 @@ def get_employee_info(grouping=None):
     
     return df
 
-if __name__ == '__main__':
-    df = get_employee_info()
+
+def main():
+    as_of = sys.argv[1] if len(sys.argv) > 1 else None
+
+    df = get_employee_info(as_of=as_of)
 
     filename = out_dir + pd.Timestamp.now().strftime('%Y%m%d%H%M')
 
@@ -158,3 +203,7 @@ if __name__ == '__main__':
     # create fml module that loads roles from here, corrects names and file numbers
 
     # create utility file for loading configurations and getting in and out dirs
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+import pandas as pd
+import numpy as np
+import sys
+
+KEY = 'payroll_number'
+
+# Text columns with at most this share of distinct values are stored as
+# category codes
+CATEGORY_RATIO = 0.5
+
+
+def format_key(payroll_number):
+    """
+    Formats a payroll number the way the Dataset classes do, so integers
+    and unpadded strings find the same employee
+    """
+    return '{0:0>6}'.format(str(payroll_number))
+
+
+def _compact(values):
+    if values.dtype.kind in 'biufcmM':
+        return values, None
+
+    categories, codes = None, None
+    if len(values) and pd.Series(values).nunique() <= len(values) * CATEGORY_RATIO:
+        cat = pd.Categorical(values)
+        codes, categories = cat.codes, np.asarray(cat.categories, dtype=object)
+    if codes is None:
+        return values.astype(object), None
+    return codes, categories
+
+
+class EmployeeIndex:
+    """
+    In-memory employee table indexed on payroll number.
+
+    Each column is kept as one numpy array, with repetitive text such as
+    positions stored as category codes, and a dict maps each payroll number
+    to its row. Single lookups are a dict access and batch lookups gather
+    all requested rows from the arrays at once, so reports can look
+    employees up without filtering whole DataFrames.
+
+        index = EmployeeIndex(employee.get_employee_info())
+        index.update(df_rank, ['rank', 'rank_scaled'])
+        index.get('001234')
+        index.lookup(['001234', 1235])
+    """
+
+    def __init__(self, df, key=KEY):
+        """
+        Args:
+            (pandas.DataFrame) df - employee data with one row per employee,
+                               as returned by employee.get_employee_info or
+                               vr.get_employee_data. If a payroll number
+                               appears more than once the last row is kept.
+            (str) key - payroll number column
+        """
+        self.key = key
+
+        keys = np.asarray([format_key(k) for k in df[key]], dtype=object)
+        self._rows = {k: i for i, k in enumerate(keys)}
+        self._keys = keys
+
+        self._columns = {}
+        self._categories = {}
+        for column in df.columns:
+            if column != key:
+                self._set_column(column, df[column].values)
+
+    def _set_column(self, column, values):
+        values, categories = _compact(np.asarray(values))
+        self._columns[column] = values
+        if categories is None:
+            self._categories.pop(column, None)
+        else:
+            self._categories[column] = categories
+
+    def _column(self, column, rows):
+        values = self._columns[column][rows]
+        categories = self._categories.get(column)
+        if categories is None:
+            return values
+        # Code -1 marks a missing value
+        if np.ndim(values) == 0:
+            return categories[values] if values >= 0 else np.nan
+        decoded = categories.take(np.maximum(values, 0)) if len(categories) \
+            else np.empty(len(values), dtype=object)
+        decoded[values < 0] = np.nan
+        return decoded
+
+    @property
+    def columns(self):
+        return [self.key] + list(self._columns)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, payroll_number):
+        return format_key(payroll_number) in self._rows
+
+    def __getitem__(self, payroll_number):
+        row = self._rows[format_key(payroll_number)]
+        record = {self.key: self._keys[row]}
+        for column in self._columns:
+            record[column] = self._column(column, row)
+        return record
+
+    def get(self, payroll_number, default=None):
+        """
+        Returns the record of one employee as a dict, or default if the
+        payroll number is not indexed
+        """
+        try:
+            return self[payroll_number]
+        except KeyError:
+            return default
+
+    def positions(self, payroll_numbers):
+        """
+        Returns the row of each payroll number, -1 for unknown ones
+        """
+        rows = self._rows
+        return np.fromiter((rows.get(format_key(k), -1) for k in payroll_numbers),
+                           dtype=np.int64, count=len(payroll_numbers))
+
+    def lookup(self, payroll_numbers, columns=None):
+        """
+        Looks up several employees at once
+
+        Args:
+            (list) payroll_numbers - payroll numbers to look up
+            (list) columns - columns to return, all columns if None
+        Returns:
+            df - Pandas DataFrame with one row per requested payroll number,
+                 in the requested order. Unknown payroll numbers get a row
+                 of missing values.
+        """
+        payroll_numbers = list(payroll_numbers)
+        if columns is None:
+            columns = list(self._columns)
+
+        rows = self.positions(payroll_numbers)
+        found = rows >= 0
+        safe_rows = np.where(found, rows, 0)
+
+        data = {self.key: [format_key(k) for k in payroll_numbers]}
+        for column in columns:
+            if column == self.key:
+                continue
+            values = self._column(column, safe_rows) if len(self) else \
+                np.full(len(rows), np.nan)
+            if not found.all():
+                values = pd.Series(values).where(found).values
+            data[column] = values
+
+        return pd.DataFrame(data, columns=[self.key] + [c for c in columns
+                                                         if c != self.key])
+
+    def update(self, df, columns=None):
+        """
+        Adds or overwrites columns for the employees in df, such as the
+        rank columns of rank.calculate_rank. Employees not in df keep their
+        values, or get missing values in new columns. Employees not in the
+        index are ignored.
+
+        Args:
+            (pandas.DataFrame) df - data keyed on the payroll number column
+            (list) columns - columns to take from df, all others if None
+        Returns:
+            EmployeeIndex - self
+        """
+        if columns is None:
+            columns = [c for c in df.columns if c != self.key]
+
+        rows = self.positions(df[self.key].tolist())
+        found = rows >= 0
+
+        for column in columns:
+            new = df[column].values[found]
+            if column in self._columns:
+                current = pd.Series(self._column(column, np.arange(len(self._keys))))
+            else:
+                current = pd.Series(new[:0]).reindex(range(len(self._keys)))
+            current.iloc[rows[found]] = new
+            self._set_column(column, current.infer_objects().values)
+
+        return self
+
+    def to_frame(self):
+        """
+        Returns the whole index as a Pandas DataFrame
+        """
+        return self.lookup(list(self._rows))
+
+    def memory_usage(self):
+        """
+        Returns the bytes held by each column's arrays
+        """
+        usage = {c: v.nbytes for c, v in self._columns.items()}
+        for c, categories in self._categories.items():
+            usage[c] += sum(sys.getsizeof(x) for x in categories)
+        return usage
+
+
+if __name__ == '__main__':
+    import employee
+
+    index = EmployeeIndex(employee.get_employee_info())
+
+    print(index.lookup(sys.argv[1:]))
@@ -1,5 +1,18 @@
 #!/usr/bin/env python3
-import pathlib, os
+import contextlib, functools, pathlib, os, gzip, zipfile
+import datetime as dt
+
+# Date formats embedded in export file names, with the characters to strip
+# (besides letters) before parsing
+FILE_DATE_FORMATS = [('%m.%d.%y.', '&_ '),
+                     ('%Y%m%d', '.:&_- ')]
+
+# Compressed files are read through gzip; the extension before it names the
+# format of the data
+GZIP_EXT = '.gz'
+
+# Members of zip archives are addressed as <archive>.zip/<member>
+ZIP_EXT = '.zip'
 
 
 def create_dir(directory):
@@ -29,16 +42,163 @@ def get_files_list(directory='/', extensions='',
     if abs_path:
         file_dir = directory
     if sub_dirs:
-        files = [os.path.join(root, f)
-                 for root, dirs, files in os.walk(directory)
-                 for f in files
-                 if f.startswith(startswith) and f.endswith(extensions)]
-        
-        files[:] = [f for f in files if os.path.basename(os.path.dirname(f)) not in exclude_dirs]
+        files = [f for f in scan_tree(directory, exclude_dirs)
+                 if os.path.basename(f).startswith(startswith)
+                 and f.endswith(extensions)]
+        return expand_archives(files, extensions)
     else:
-        files = [file_dir + f for f in os.listdir(directory)
+        files = [f for f in os.listdir(directory)
                  if f.startswith(startswith) and f.endswith(extensions)]
-    return files
+        files = expand_archives(files, extensions, directory)
+        return [file_dir + f for f in files]
+
+
+def expand_archives(files, extensions='', directory=''):
+    """
+    Replaces the zip archives in a list of files with the paths of their
+    members that have one of the given extensions
+
+    Args:
+        (list) files - file paths
+        (tuple) extensions - member extensions to include, all by default
+        (str) directory - directory the file paths are relative to
+    Returns:
+        files - List of file and archive member paths
+    """
+    expanded = []
+    for f in files:
+        if f.endswith(ZIP_EXT):
+            expanded.extend(list_archive(f, extensions, directory))
+        else:
+            expanded.append(f)
+    return expanded
+
+
+def list_archive(archive, extensions='', directory=''):
+    """
+    Lists the members of a zip archive as <archive>/<member> paths, skipping
+    directories, nested archives and members starting with ~ or .
+    """
+    with zipfile.ZipFile(os.path.join(directory, archive)) as z:
+        members = [m for m in z.namelist() if not m.endswith('/')]
+
+    return [os.path.join(archive, m) for m in sorted(members)
+            if not os.path.basename(m).startswith(('~', '.'))
+            and not m.endswith(ZIP_EXT) and m.endswith(extensions)]
+
+
+def split_archive_path(filepath):
+    """
+    Splits an archive member path into the archive and member names
+
+    Returns:
+        tuple - archive path and member name, or (filepath, None) if the
+                path is not inside a zip archive
+    """
+    marker = ZIP_EXT + '/'
+    index = filepath.find(marker)
+    while index != -1:
+        archive = filepath[:index + len(ZIP_EXT)]
+        if os.path.isfile(archive):
+            return archive, filepath[index + len(marker):]
+        index = filepath.find(marker, index + 1)
+    return filepath, None
+
+
+def data_name(filepath):
+    """
+    Returns the base name of a file or archive member without the .gz
+    extension, whose extension names the format of the data
+    """
+    name = os.path.basename(filepath)
+    if name.endswith(GZIP_EXT):
+        name = name[:-len(GZIP_EXT)]
+    return name
+
+
+@contextlib.contextmanager
+def open_data(filepath, raw=False):
+    """
+    Context manager that opens a plain file, a gzip compressed file or a
+    zip archive member for binary reading. The data is decompressed as it
+    is read, nothing is unpacked to disk.
+
+    Args:
+        (str) filepath - file or archive member path
+        (bool) raw - read .gz files as the compressed bytes they store
+    """
+    archive, member = split_archive_path(filepath)
+    with contextlib.ExitStack() as stack:
+        if member is None:
+            f = stack.enter_context(open(filepath, 'rb'))
+        else:
+            z = stack.enter_context(zipfile.ZipFile(archive))
+            f = stack.enter_context(z.open(member))
+
+        if filepath.endswith(GZIP_EXT) and not raw:
+            f = stack.enter_context(gzip.GzipFile(fileobj=f, mode='rb'))
+
+        yield f
+
+
+def stat_data(filepath):
+    """
+    Returns os.stat of a file, or of the archive holding an archive member
+    """
+    return os.stat(split_archive_path(filepath)[0])
+
+
+def scan_tree(directory, exclude_dirs=[]):
+    """
+    Walks a directory tree with os.scandir, skipping excluded directories
+    without descending into them.
+
+    Args:
+        (str) directory - root directory to walk
+        (list) exclude_dirs - directory names to prune from the walk
+    Returns:
+        files - List of file paths found under directory
+    """
+    files = []
+    stack = [directory]
+    while stack:
+        current = stack.pop()
+        try:
+            entries = list(os.scandir(current))
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name not in exclude_dirs:
+                    stack.append(entry.path)
+            elif entry.is_file():
+                files.append(entry.path)
+    return sorted(files)
+
+
+def get_file_date(filename, formats=FILE_DATE_FORMATS):
+    """
+    Parses the snapshot date embedded in an export file name. Results are
+    cached by base name, so listing a directory again parses nothing.
+
+    Args:
+        (str) filename - file name or path; only the base name is used
+        (list) formats - (format, characters to strip) pairs tried in order
+    Returns:
+        date - datetime.date of the snapshot, or None if no format matches
+    """
+    return _parse_file_date(data_name(filename), tuple(formats))
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_file_date(name, formats):
+    for fmt, strip in formats:
+        digits = ''.join(c for c in name if not c.isalpha() and c not in strip)
+        try:
+            return dt.datetime.strptime(digits, fmt).date()
+        except ValueError:
+            continue
+    return None
 
 
 def get_subdirectories(directory):
@@ -1,4 +1,3 @@
-import pandas as pd
 import os
 import file_utils, df_utils
 import datetime as dt
@@ -22,7 +21,7 @@ def create_dirs():
 
 
 def read_data(filename):
-    df = pd.read_excel(filename)
+    df = df_utils.load_data(filename)
     df = df.rename(columns={' Start Date': 'Start Date', 'Expected  End Date': 'Expected End Date'})
     if 'Comments' in df.columns:
         df['Comments'].fillna('', inplace=True)
@@ -32,7 +31,7 @@ def read_data(filename):
     return df
 
 
-if __name__ == '__main__':
+def main():
     create_dirs()
 
     for fml_type in FML_TYPES:
@@ -45,7 +44,10 @@ if __name__ == '__main__':
             file_dates = []
             for f in files:
                 if not f.startswith('~'):
-                    date = dt.datetime.strptime(''.join(c for c in f if not c.isalpha() and c not in '&_ '), '%m.%d.%y.').date()
+                    date = file_utils.get_file_date(f)
+                    if date is None:
+                        print('\nSkipping {}: no date in file name'.format(department_dir + f))
+                        continue
                     date = dt.datetime.strftime(date, '%Y%m%d')
                     file_dates.append({'filename': f, 'date': date})
 
@@ -64,7 +66,17 @@ if __name__ == '__main__':
                             old_df = read_data(department_dir + f['filename'])
                             new_df = read_data(department_dir + file_dates[index]['filename'])
                             
-                            diff_df = df_utils.df_diff(old_df, new_df)
-                            diff_df.to_csv(filename, index=False)
+                            diff = df_utils.diff_rows(old_df, new_df)
+                            diff.added.to_csv(filename, index=False)
+
+                            print('\nSaving to file {}'.format(filename))
+
+                            if not diff.removed.empty:
+                                removed_filename = filename[:-len('_diff.csv')] + '_removed.csv'
+                                diff.removed.to_csv(removed_filename, index=False)
 
-                            print('\nSaving to file {}'.format(filename))
\ No newline at end of file
+                                print('Saving to file {}'.format(removed_filename))
+
+
+if __name__ == '__main__':
+    main()
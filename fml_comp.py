@@ -25,12 +25,11 @@ def create_dirs():
 
 
 def read_data(filename):
-    df = pd.read_excel(filename)
+    df = df_utils.load_data(filename)
     df.drop(df.columns[df.columns.str.contains('Unnamed', case=False)], axis=1, inplace=True)
 
     df = df_utils.normalize_columns(df)
-    for column in df.select_dtypes(include='object'):
-        df[column] = df[column].str.upper().str.strip()
+    df_utils.normalize_text_columns(df, upper=True)
 
     df = df.rename(columns={'_start_date': 'start_date', 'expected__end_date': 'expected_end_date', 'ee#': 'payroll_number', 'ee_#': 'payroll_number'})
     if 'comments' in df.columns:
@@ -43,7 +42,61 @@ def read_data(filename):
     return df
 
 
-if __name__ == '__main__':
+def first_last_appearance(snapshots):
+    """
+    Finds the first and most recent snapshot date of every distinct record.
+
+    Rows are keyed by a fingerprint of their values, so only one copy of each
+    distinct record is kept and memory grows with the number of distinct
+    records rather than the total number of snapshot rows.
+
+    Args:
+        (iterable) snapshots - (date, pandas.DataFrame) pairs
+    Returns:
+        df - Pandas DataFrame with one row per distinct record and its
+             most_recent_appearance and first_appearance dates, newest
+             first appearance first
+    """
+    columns = []
+    records = pd.DataFrame()
+    record_hashes = np.array([], dtype='uint64')
+    appearances = pd.DataFrame(columns=['first_appearance', 'most_recent_appearance'])
+
+    for date, df in snapshots:
+        new_columns = [col for col in df.columns if col not in columns]
+        if new_columns:
+            # Records seen so far are blank in the new columns
+            columns.extend(new_columns)
+            old_hashes = record_hashes
+            record_hashes = df_utils.row_hashes(records, columns)
+            appearances = appearances.rename(index=dict(zip(old_hashes, record_hashes)))
+
+        hashes = df_utils.row_hashes(df, columns)
+        hashes, first_rows = np.unique(hashes, return_index=True)
+
+        is_new = ~np.isin(hashes, record_hashes)
+        records = pd.concat([records, df.iloc[first_rows[is_new]]],
+                            ignore_index=True, sort=False)
+        record_hashes = np.concatenate([record_hashes, hashes[is_new]])
+
+        seen = pd.DataFrame({'first_appearance': date,
+                             'most_recent_appearance': date}, index=hashes)
+        appearances = pd.concat([appearances, seen]).groupby(level=0) \
+            .agg({'first_appearance': 'min', 'most_recent_appearance': 'max'})
+
+    records = records.reindex(columns=columns)
+    records['most_recent_appearance'] = appearances['most_recent_appearance'] \
+        .reindex(record_hashes).values
+    records['first_appearance'] = appearances['first_appearance'] \
+        .reindex(record_hashes).values
+
+    records = records.sort_values(by=['first_appearance'], ascending=False)
+    records.reset_index(drop=True, inplace=True)
+
+    return records
+
+
+def main():
     create_dirs()
 
     for fml_type in FML_TYPES:
@@ -56,7 +109,10 @@ if __name__ == '__main__':
             file_dates = []
             for f in files:
                 if not f.startswith('~'):
-                    date = dt.datetime.strptime(''.join(c for c in f if not c.isalpha() and c not in '&_ '), '%m.%d.%y.').date()
+                    date = file_utils.get_file_date(f)
+                    if date is None:
+                        print('\nSkipping {}: no date in file name'.format(department_dir + f))
+                        continue
                     date = dt.datetime.strftime(date, '%Y%m%d')
                     file_dates.append({'filename': f, 'date': date})
 
@@ -70,31 +126,10 @@ if __name__ == '__main__':
                 start_time = time.time()
                 print('\nWorking on {}'.format(filename))
 
-                comp_df = pd.DataFrame()
-                for index, f in enumerate(file_dates, 1):
-                    df = read_data(department_dir + f['filename'])
-                    df['date'] = f['date']
-                    df['date'] = pd.to_datetime(df['date'])
-
-                    comp_df = comp_df.append(df)
-
-                first_df = comp_df.sort_values(by=['date'], ascending=True)
-                first_df.reset_index(drop=True, inplace=True)
-                first_df = first_df.rename(index=str, columns={'date': 'first_appearance'})
-                first_df = first_df.drop_duplicates(subset=[col for col in first_df.columns if col not in ['first_appearance']])
-                last_df = comp_df.sort_values(by=['date'], ascending=False)
-                last_df.reset_index(drop=True, inplace=True)
-                last_df = last_df.rename(index=str, columns={'date': 'most_recent_appearance'})
-                last_df = last_df.drop_duplicates(subset=[col for col in last_df.columns if col not in ['most_recent_appearance']])
-
-                comp_df = pd.merge(first_df, last_df)
-                comp_df = comp_df.sort_values(by=['first_appearance'], ascending=False)
+                snapshots = ((pd.Timestamp(f['date']), read_data(department_dir + f['filename']))
+                             for f in file_dates)
 
-                columns = comp_df.columns.tolist()
-                columns = [col for col in columns if col not in ['most_recent_appearance', 'first_appearance']]
-                columns.extend(['most_recent_appearance', 'first_appearance'])
-
-                comp_df = comp_df[columns]
+                comp_df = first_last_appearance(snapshots)
 
                 comp_df.to_csv(filename, index=False)
 
@@ -104,3 +139,7 @@ if __name__ == '__main__':
 
     # Open output directory
     os.startfile(OUTPUT_DIR)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+import contextlib, tracemalloc
+
+MB = 1024 * 1024
+
+# Number of DataFrames listed in the report
+TOP_FRAMES = 10
+
+
+class MemoryBudgetExceeded(Exception):
+    pass
+
+
+class MemoryProfiler:
+    """
+    Records peak and retained memory per stage and per input file with
+    tracemalloc, and the footprint of DataFrames handed to track().
+
+    The profiler is disabled until start() is called; stage() and track()
+    cost nothing while it is disabled, so the pipeline can be instrumented
+    permanently.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.budget = None
+        self.stages = []
+        self.frames = []
+        # Peak of each open stage up to its last child stage's start, since
+        # starting a stage resets tracemalloc's peak
+        self._peaks = []
+
+    def start(self, budget_mb=None):
+        """
+        Starts profiling
+
+        Args:
+            (float) budget_mb - peak memory in MB above which the run fails,
+                    or None for no limit
+        """
+        self.enabled = True
+        self.budget = budget_mb * MB if budget_mb else None
+        self.stages = []
+        self.frames = []
+        self._peaks = []
+        tracemalloc.start()
+
+    def stop(self):
+        self.enabled = False
+        tracemalloc.stop()
+
+    def _reset_peak(self):
+        # tracemalloc.reset_peak is only available from Python 3.9
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+
+    @contextlib.contextmanager
+    def stage(self, name, filepath=None):
+        """
+        Context manager that records the memory of the enclosed code
+
+        Args:
+            (str) name - stage name
+            (str) filepath - input file processed in the stage, if any
+        """
+        if not self.enabled:
+            yield
+            return
+
+        start_current, parent_peak = tracemalloc.get_traced_memory()
+        if self._peaks:
+            self._peaks[-1] = max(self._peaks[-1], parent_peak)
+        self._peaks.append(0)
+        self._reset_peak()
+
+        try:
+            yield
+        finally:
+            current, peak = tracemalloc.get_traced_memory()
+            peak = max(peak, self._peaks.pop())
+            # The enclosing stage peaked at least as high as this one
+            if self._peaks:
+                self._peaks[-1] = max(self._peaks[-1], peak)
+            self.stages.append({'stage': name,
+                                'file': filepath,
+                                'depth': len(self._peaks),
+                                'peak_mb': peak / MB,
+                                'retained_mb': (current - start_current) / MB})
+
+        if self.budget is not None and peak > self.budget:
+            raise MemoryBudgetExceeded(
+                'Stage {} peaked at {:.1f} MB, over the {:.1f} MB budget'
+                .format(name, peak / MB, self.budget / MB))
+
+    def track(self, name, df):
+        """
+        Records the per-column memory footprint of a DataFrame
+        """
+        if not self.enabled or df is None or not hasattr(df, 'memory_usage'):
+            return df
+
+        usage = df.memory_usage(index=True, deep=True)
+        self.frames.append({'name': name,
+                            'rows': len(df),
+                            'total_mb': usage.sum() / MB,
+                            'columns': [(str(col), size / MB)
+                                        for col, size in usage.sort_values(ascending=False).items()]})
+        return df
+
+    def report(self, path=None, top=TOP_FRAMES):
+        """
+        Builds a text report of the stages and the largest DataFrames, and
+        writes it to path if given
+
+        Returns:
+            str - the report
+        """
+        lines = ['Memory profile', '']
+        lines.append('{:<40} {:>10} {:>12}  {}'.format('Stage', 'Peak MB',
+                                                       'Retained MB', 'File'))
+        for s in self.stages:
+            lines.append('{:<40} {:>10.1f} {:>12.1f}  {}'.format(
+                '  ' * s['depth'] + s['stage'], s['peak_mb'],
+                s['retained_mb'], s['file'] or ''))
+
+        if self.stages:
+            worst = max(self.stages, key=lambda s: s['peak_mb'])
+            lines.extend(['', 'Highest peak: {} ({:.1f} MB)'.format(
+                worst['stage'], worst['peak_mb'])])
+
+        lines.extend(['', 'Largest DataFrames'])
+        for f in sorted(self.frames, key=lambda f: f['total_mb'], reverse=True)[:top]:
+            lines.append('{} - {} rows, {:.1f} MB'.format(f['name'], f['rows'],
+                                                         f['total_mb']))
+            for col, size in f['columns']:
+                lines.append('    {:<36} {:>10.2f} MB'.format(col, size))
+
+        text = '\n'.join(lines) + '\n'
+
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(text)
+
+        return text
+
+
+# Shared profiler used by the instrumented modules
+profiler = MemoryProfiler()
+
+stage = profiler.stage
+
+track = profiler.track
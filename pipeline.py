@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+import queue, threading
+
+# Number of items each queue holds before the stage feeding it waits
+QUEUE_SIZE = 2
+
+_DONE = object()
+
+
+class Stage:
+    """
+    One step of a Pipeline: a function applied to every item, run by one
+    or more threads
+    """
+
+    def __init__(self, name, func, workers=1):
+        """
+        Args:
+            (str) name - stage name, used in thread names
+            (function) func - takes an item and returns the item passed on
+                       to the next stage. Returning None drops the item.
+            (int) workers - number of threads running the stage
+        """
+        self.name = name
+        self.func = func
+        self.workers = workers
+
+
+class Pipeline:
+    """
+    Runs items through stages connected by bounded queues, each stage on
+    its own threads, so reading, computing and writing overlap.
+
+    A stage blocks when the queue to the next stage is full, which caps the
+    number of items in flight at about the queue sizes plus the workers,
+    whatever the number of items. The first exception raised by a stage
+    stops the pipeline and is raised again by run().
+
+        pipe = Pipeline([Stage('read', read), Stage('rank', rank),
+                         Stage('write', write)])
+        results = pipe.run(paths)
+    """
+
+    def __init__(self, stages, queue_size=QUEUE_SIZE):
+        self.stages = stages
+        self.queue_size = queue_size
+
+    def _put(self, q, item, stop):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q, stop):
+        while not stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def run(self, items):
+        """
+        Passes each item through all stages
+
+        Args:
+            (iterable) items - inputs of the first stage, consumed lazily
+        Returns:
+            list - outputs of the last stage, in completion order
+        """
+        queues = [queue.Queue(self.queue_size) for _ in range(len(self.stages) + 1)]
+        stop = threading.Event()
+        errors = []
+        results = []
+
+        def feed():
+            try:
+                for item in items:
+                    if not self._put(queues[0], item, stop):
+                        return
+            except Exception as e:
+                errors.append(e)
+                stop.set()
+            finally:
+                self._put(queues[0], _DONE, stop)
+
+        def work(stage, q_in, q_out, remaining):
+            while True:
+                item = self._get(q_in, stop)
+                if item is _DONE:
+                    if stop.is_set():
+                        return
+                    # Leave the end marker for the stage's other workers and
+                    # pass it on once all of them are done
+                    self._put(q_in, _DONE, stop)
+                    with remaining['lock']:
+                        remaining['count'] -= 1
+                        last = remaining['count'] == 0
+                    if last:
+                        self._put(q_out, _DONE, stop)
+                    return
+                try:
+                    out = stage.func(item)
+                except Exception as e:
+                    errors.append(e)
+                    stop.set()
+                    return
+                if out is not None and not self._put(q_out, out, stop):
+                    return
+
+        threads = [threading.Thread(target=feed, name='pipeline-feed', daemon=True)]
+        for i, stage in enumerate(self.stages):
+            remaining = {'count': stage.workers, 'lock': threading.Lock()}
+            for n in range(stage.workers):
+                threads.append(threading.Thread(
+                    target=work, args=(stage, queues[i], queues[i + 1], remaining),
+                    name='pipeline-{}-{}'.format(stage.name, n), daemon=True))
+
+        for t in threads:
+            t.start()
+
+        while True:
+            item = self._get(queues[-1], stop)
+            if item is _DONE:
+                break
+            results.append(item)
+
+        for t in threads:
+            t.join()
+
+        if errors:
+            raise errors[0]
+
+        return results
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 import pandas as pd
-import employee, file_utils, dataset, report_type
-import os, time
+import employee, file_utils, df_utils, date_utils, dataset, report_type, catalog, warehouse, attendance_cube
+import os, sys, time
 import datetime as dt
 from dateutil.relativedelta import relativedelta
 
@@ -19,7 +19,7 @@ in_dir = CUR_DIR + '/data/points/'
 EXCLUDE_DIRS = ['old']
 
 # Extensions to include in file list
-EXT = (('.xls', '.xlsx', '.csv', '.htm'))
+EXT = (('.xls', '.xlsx', '.csv', '.htm', '.csv.gz', '.htm.gz', '.zip'))
 
 # Set pandas to display all columns
 pd.set_option('display.max_columns', None)
@@ -43,32 +43,64 @@ def setup():
     create_dirs()
 
 
-def get_attendance_info(num_of_totals=1):
-    setup()
-
-    files = file_utils.get_files_list(directory=in_dir, extensions=EXT,
-                                      abs_path=True, sub_dirs=True, exclude_dirs=EXCLUDE_DIRS)
+def load_files(num_of_totals):
+    cat = catalog.Catalog(in_dir, extensions=EXT, exclude_dirs=EXCLUDE_DIRS,
+                          dataset_cls=dataset.Dataset)
+    cat.refresh()
 
-    datasets = []
-    dates = []
+    datasets = cat.datasets(report_type=report_type.Report_Type.LEAVE_TAKEN)
+    datasets = datasets[-num_of_totals:]
 
     start_time = time.time()
-    for f in files:
-        if not '/~' in f:
-            datasets.append(dataset.Dataset(f))
-            date = dt.datetime.strptime(''.join(c for c in f if not c.isalpha() and c not in '.:/&_ '), '%Y%m%d').date()
-            dates.append(date)
+
+    dfs = [x.df for x in datasets]
+    dates = [x.snapshot_date for x in datasets]
 
     print("\nLoading all files took {} seconds.".format(time.time() - start_time))
 
-    df_emp = employee.get_employee_info()
+    warehouse.store_datasets(datasets)
+
+    return dfs, dates
+
+
+def load_warehouse(num_of_totals, as_of):
+    wh = warehouse.Warehouse()
+
+    snaps = wh.snapshots(report_type.Report_Type.LEAVE_TAKEN, as_of=as_of)
+    snaps = snaps.tail(num_of_totals)
+
+    dfs = [wh.load_snapshot(report_type.Report_Type.LEAVE_TAKEN, x)
+           for x in snaps['snapshot_id']]
+    dates = list(date_utils.parse_dates(snaps['snapshot_date'],
+                                        formats=date_utils.ISO_FORMATS).dt.date)
+
+    wh.close()
+
+    return dfs, dates
+
+
+def get_attendance_info(num_of_totals=1, as_of=None):
+    setup()
+
+    if as_of is None:
+        dfs, dates = load_files(num_of_totals)
+    else:
+        dfs, dates = load_warehouse(num_of_totals, as_of)
+
+    df_emp = employee.get_employee_info(as_of=as_of)
+
+    if as_of is None:
+        # Fold the newly stored snapshots into the attendance cube, once the
+        # employee files they are matched to are stored as well
+        cube = attendance_cube.AttendanceCube()
+        cube.update()
+        cube.close()
 
     df = pd.DataFrame()
     cols = []
 
     for i in range(num_of_totals, 0, -1):
-        df_lt = [x.df for x in datasets \
-            if x.df_type == report_type.Report_Type.LEAVE_TAKEN][-i]
+        df_lt = dfs[-i]
 
         df_att = get_attendance_from_leave_taken(df_emp, df_lt)
 
@@ -107,14 +139,10 @@ def get_start_date(date):
 
 def get_attendance_from_leave_taken(df_main, df_att):
     df_att = df_att[['payroll_number', 'date', 'actual_leave']]
-    df_att = pd.merge(df_att, df_main, how='left', on='payroll_number')
-
-    df_att['payroll_number'].fillna(method='ffill', inplace=True)
 
-    df_att['date'] = pd.to_datetime(df_att['date'])
-    df_att['role_date'] = pd.to_datetime(df_att['role_date'])
-
-    df_att = df_att[df_att['date'] >= df_att['role_date']]
+    # Keep only leave taken since the employee's current role date
+    df_att = df_utils.match_role_dates(df_att, df_main,
+                                       report=report_type.Report_Type.LEAVE_TAKEN)
 
     df_att['points'] = df_att['actual_leave'].str.split('-') \
         .str[-1].str.strip(' ')
@@ -142,8 +170,10 @@ def get_attendance_from_leave_taken(df_main, df_att):
 
     return df
 
-if __name__ == '__main__':
-    df = get_attendance_info(2)
+def main():
+    as_of = sys.argv[1] if len(sys.argv) > 1 else None
+
+    df = get_attendance_info(2, as_of=as_of)
 
     positions = employee.get_positions()
     positions = positions[['position', 'att_group']]
@@ -170,3 +200,7 @@ if __name__ == '__main__':
 
     # Open output directory
     os.startfile(out_dir)
+
+
+if __name__ == '__main__':
+    main()
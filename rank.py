@@ -1,8 +1,9 @@
 #!/usr/bin/env python3
 import pandas as pd
 import numpy as np
-import file_utils, df_utils, vr
-import os, sys, time
+import file_utils, df_utils, vr, warehouse, catalog, shared_frames, mem_profile, pipeline
+import argparse, multiprocessing, os, sys, tempfile, time
+from concurrent.futures import ThreadPoolExecutor
 
 # Current working directory
 CURRENT_DIR = os.getcwd()
@@ -16,7 +17,7 @@ SCAN_DIR = CURRENT_DIR + '/data/rank/'
 EXCLUDE_DIRS = ['old']
 
 # Extensions to include in file list
-EXT = (('.xls', '.xlsx', '.csv', '.htm'))
+EXT = (('.xls', '.xlsx', '.csv', '.htm', '.csv.gz', '.htm.gz', '.zip'))
 
 # Set pandas to display all columns
 pd.set_option('display.max_columns', None)
@@ -27,20 +28,43 @@ def create_dirs():
     file_utils.create_dir(SCAN_DIR)
 
 
-def calculate_rank(df):
+def _scale_lookup(values, value_range, scale, name='value'):
     """
-    Calculates employee ranking from provided employee information
+    Looks up the scale value at the position of each value in value_range.
+    Raises ValueError if any value is not in value_range, since it could
+    not be ranked.
+    """
+    order = np.argsort(value_range, kind='mergesort')
+    sorted_range = value_range[order]
+    sorted_scale = scale[order]
+
+    idx = np.searchsorted(sorted_range, values)
+    idx = np.clip(idx, 0, sorted_range.size - 1)
+    found = sorted_range[idx] == values
+
+    if not found.all():
+        missing = pd.unique(values[~found])
+        raise ValueError('{} {} values are not on the ranking scale: {}'
+                         .format((~found).sum(), name,
+                                 ', '.join(str(x) for x in missing[:10])))
+
+    return sorted_scale[idx]
+
+
+def scale_scores(df, max_score=None, role_dates=None):
+    """
+    Adds attendance, performance and role date scores scaled from 0 to 1
 
     Args:
         (pandas.DataFrame) df - dataset containing employee information
+        (float) max_score - highest eval score of the whole roster.
+                Defaults to the maximum in df.
+        (tuple) role_dates - earliest and latest role date of the whole
+                roster. Defaults to the range in df.
     Returns:
-        df - Pandas DataFrame that has a calculated rank for each employee
+        df - Pandas DataFrame with capped_points, att_scaled, perf_scaled
+             and role_scaled columns
     """
-    # Ranking percentage weights
-    eval_pct = 0.7
-    att_pct = 0.2
-    role_pct = 0.1
-
     # Attendance range: 0 to 12 reversed, increments of 0.5
     att_range = np.arange(50, 1250, 50)[::-1]
     att_range = att_range / 100
@@ -52,38 +76,50 @@ def calculate_rank(df):
     eval_range = np.arange(100, 505, 5)
     eval_range = eval_range / 100
     eval_range = np.insert(eval_range, 0, 0)
+    if max_score is None:
+        max_score = df['competency_score'].max()
     eval_range = np.delete(eval_range,
-                           np.argwhere(eval_range > df['competency_score']
-                                       .max()))
+                           np.argwhere(eval_range > max_score))
     perf_scale = np.linspace(0, 1, eval_range.size)
 
     # Role date range: min role date to max role date reversed,
     # increments of 1 day
-    role_date_range = pd.date_range(df['role_date'].min(),
-                                    df['role_date'].max(), freq='D')[::-1]
-    role_date_len = len(pd.date_range(df['role_date'].min(),
-                                      df['role_date'].max(), freq='D'))
-    role_scale = np.linspace(0, 1, role_date_len)
+    if role_dates is None:
+        role_dates = (df['role_date'].min(), df['role_date'].max())
+    role_date_range = pd.date_range(role_dates[0], role_dates[1],
+                                    freq='D')[::-1]
+    role_scale = np.linspace(0, 1, len(role_date_range))
 
     # Set point maximum to 12
-    df['capped_points'] = df['points'].apply(lambda x: 12 if x > 12 else x)
+    df['capped_points'] = df['points'].clip(upper=12)
 
     # Lookup index of values from appropriate scale
-    df['att_scaled'] = df['capped_points'] \
-        .apply(lambda x: att_scale[att_range == x]).astype(float)
+    df['att_scaled'] = _scale_lookup(df['capped_points'].values.astype(float),
+                                     att_range, att_scale, 'points')
 
-    df['perf_scaled'] = df['competency_score'] \
-        .apply(lambda x: perf_scale[eval_range == x]).astype(float)
+    df['perf_scaled'] = _scale_lookup(df['competency_score'].values
+                                      .astype(float), eval_range, perf_scale,
+                                      'competency_score')
 
-    df['role_scaled'] = df['role_date'] \
-        .apply(lambda x: role_scale[role_date_range == x]).astype(float)
+    df['role_scaled'] = _scale_lookup(df['role_date'].values
+                                      .astype('datetime64[ns]').astype('int64'),
+                                      role_date_range.values
+                                      .astype('datetime64[ns]').astype('int64'),
+                                      role_scale, 'role_date')
 
-    # Calculate total ranking score using percentage weights
-    df['rank_scaled'] = df['att_scaled'] * att_pct + df['perf_scaled'] \
-        * eval_pct + df['role_scaled'] * role_pct
+    return df
 
-    # Separate employees into three groups: has an eval score,
-    # no eval score, contingent employees
+
+def split_tiers(df):
+    """
+    Separates employees into three groups: has an eval score,
+    no eval score, contingent employees
+
+    Args:
+        (pandas.DataFrame) df - dataset containing employee information
+    Returns:
+        tuple - the three groups as Pandas DataFrames
+    """
     df_score = df.query('competency_score > 0')
 
     df_noscore = df.loc[(df['competency_score'] == 0) &
@@ -91,22 +127,89 @@ def calculate_rank(df):
 
     df_temp = df.loc[df['payroll_number'].str.startswith('C')]
 
-    # Sort employees with an eval score by rank score
-    df_score = df_score.sort_values(by=['rank_scaled'], ascending=False)
+    return df_score, df_noscore, df_temp
+
+
+def select_top(df, k, keys, ascending):
+    """
+    Selects the first k rows of a DataFrame in the order of the given sort
+    keys without sorting all of it. The k-th value of the first key is
+    found by partitioning, and only the rows up to it, ties included, are
+    sorted by all keys.
+
+    Args:
+        (pandas.DataFrame) df - rows to select from
+        (int) k - number of rows to select
+        (list) keys - sort keys, the first of them numeric
+        (tuple) ascending - sort direction of each key
+    Returns:
+        df - Pandas DataFrame with the first k rows in sorted order
+    """
+    values = df[keys[0]].values.astype(float)
+    if not ascending[0]:
+        values = -values
+
+    if len(df) > k > 0:
+        kth = np.partition(values, k - 1)[k - 1]
+        if not np.isnan(kth):
+            df = df[values <= kth]
+
+    return df.sort_values(by=keys, ascending=ascending).head(k)
+
+
+# Sort keys of the score, no score and contingent tiers. Ties in rank
+# score are broken by seniority, then attendance, then payroll number.
+TIER_KEYS = [(['rank_scaled', 'role_scaled', 'att_scaled', 'payroll_number'],
+              (False, False, False, True)),
+             (['role_scaled', 'att_scaled', 'payroll_number'],
+              (False, False, True)),
+             (['role_scaled', 'att_scaled', 'payroll_number'],
+              (False, False, True))]
+
+
+def calculate_rank(df, eval_pct=0.7, att_pct=0.2, role_pct=0.1, top_k=None):
+    """
+    Calculates employee ranking from provided employee information
+
+    Args:
+        (pandas.DataFrame) df - dataset containing employee information
+        (float) eval_pct - weight of the performance score
+        (float) att_pct - weight of the attendance score
+        (float) role_pct - weight of the role date score
+        (int) top_k - rank only the first top_k employees. Each tier is
+              partitioned rather than sorted, giving the same order as the
+              first top_k rows of the full ranking.
+    Returns:
+        df - Pandas DataFrame that has a calculated rank for each employee,
+             or for the first top_k employees
+    """
+    df = scale_scores(df)
+
+    # Calculate total ranking score using percentage weights
+    df['rank_scaled'] = df['att_scaled'] * att_pct + df['perf_scaled'] \
+        * eval_pct + df['role_scaled'] * role_pct
+
+    df_score, df_noscore, df_temp = split_tiers(df)
+
+    if top_k is not None:
+        return _partial_rank([df_score, df_noscore, df_temp], top_k)
+
+    # Sort employees with an eval score by rank score, then seniority,
+    # then attendance, then payroll number
+    keys, ascending = TIER_KEYS[0]
+    df_score = df_score.sort_values(by=keys, ascending=ascending)
     df_score.reset_index(drop=True, inplace=True)
 
     # Sort employees without an eval score by seniority,
     # then attendance, then payroll number
-    df_noscore = df_noscore \
-        .sort_values(by=['role_scaled', 'att_scaled', 'payroll_number'],
-                     ascending=(False, False, True))
+    keys, ascending = TIER_KEYS[1]
+    df_noscore = df_noscore.sort_values(by=keys, ascending=ascending)
     df_noscore.reset_index(drop=True, inplace=True)
 
     # Sort contingent employees without an eval score by seniority,
     # then attendance, then payroll number
-    df_temp = df_temp \
-        .sort_values(by=['role_scaled', 'att_scaled', 'payroll_number'],
-                     ascending=(False, False, True))
+    keys, ascending = TIER_KEYS[2]
+    df_temp = df_temp.sort_values(by=keys, ascending=ascending)
     df_temp.reset_index(drop=True, inplace=True)
 
     # Stitch all three groups back together and create a number rank
@@ -118,105 +221,472 @@ def calculate_rank(df):
     return df
 
 
-if __name__ == '__main__':
-    create_dirs()
+def _partial_rank(tiers, top_k):
+    parts = []
+    remaining = top_k
+    for df_tier, (keys, ascending) in zip(tiers, TIER_KEYS):
+        if remaining <= 0:
+            break
+        part = select_top(df_tier, remaining, keys, ascending)
+        parts.append(part)
+        remaining -= len(part)
+
+    df = pd.concat(parts or [tiers[0].head(0)], ignore_index=True, sort=False)
+    df['rank'] = df.index + 1
+
+    return df
 
-    files = file_utils.get_files_list(directory=SCAN_DIR, extensions=EXT,
-                                      abs_path=True, sub_dirs=True, exclude_dirs=EXCLUDE_DIRS)
 
-    datasets = []
-    perf = False
-    role = False
-    lt = False
-    pts = False
+def load_files(scan_dir=None):
+    """
+    Loads the ranking datasets from the input files and stores them in the
+    warehouse. Only the newest role date, leave and employee list file of
+    each group is parsed.
+
+    Args:
+        (str) scan_dir - directory of the input files, SCAN_DIR by default
+    Returns:
+        tuple - performance, role date, leave taken and leave entitlement
+                frames, and a list of (employee list frame, group name) pairs
+    """
+    cat = catalog.Catalog(scan_dir or SCAN_DIR, extensions=EXT, exclude_dirs=EXCLUDE_DIRS,
+                          dataset_cls=vr.Dataset)
+    cat.refresh()
+
+    datasets = cat.datasets()
 
     start_time = time.time()
-    for f in files:
-        if not '/~' in f:
-            datasets.append(vr.Dataset(f))
-            if datasets[-1].df_type == vr.ReportType.PERFORMANCE:
-                perf = True
-            elif datasets[-1].df_type == vr.ReportType.ROLE_DATE:
-                role = True
-            elif datasets[-1].df_type == vr.ReportType.LEAVE_TAKEN:
-                lt = True
-            elif datasets[-1].df_type == vr.ReportType.LEAVE_ENT:
-                pts = True
-
-    if not perf:
-        print('\nNo performance score data found.')
-        sys.exit(0)
-    elif not role:
-        print('\nNo role date data found.')
-        sys.exit(0)
-    elif not lt and not pts:
-        print('\nNo attendance data found.')
-        sys.exit(0)
-    
+
+    def newest(report_type):
+        ds = datasets.newest(report_type)
+        return ds.df if ds is not None else pd.DataFrame()
+
+    df_perf = df_utils.append_dfs([x.df for x in \
+        datasets.of_type(vr.ReportType.PERFORMANCE)])
+
+    df_role = newest(vr.ReportType.ROLE_DATE)
+    df_att_lt = newest(vr.ReportType.LEAVE_TAKEN)
+    df_att_pts = newest(vr.ReportType.LEAVE_ENT)
+
+    emp_lists = datasets.of_type(vr.ReportType.EMPLOYEE_LIST)
+    groups = [(emp_lists.newest(group=group).df, group)
+              for group in emp_lists.groups()]
+
     print("\nLoading all files took {} seconds.".format(time.time() - start_time))
 
-    df_perf = df_utils.append_dfs([x.df for x in datasets \
-        if x.df_type == vr.ReportType.PERFORMANCE]) 
+    warehouse.store_datasets(datasets.loaded())
+
+    return df_perf, df_role, df_att_lt, df_att_pts, groups
+
+
+def load_warehouse(as_of):
+    """
+    Loads the ranking datasets from the warehouse as they were on a date
 
-    df_role = [x.df for x in datasets \
-        if x.df_type == vr.ReportType.ROLE_DATE][0]
+    Args:
+        (str) as_of - date of the query
+    Returns:
+        tuple - same as load_files
+    """
+    wh = warehouse.Warehouse()
 
-    df_att_lt = pd.DataFrame()
-    if lt:
-        df_att_lt = [x.df for x in datasets \
-            if x.df_type == vr.ReportType.LEAVE_TAKEN][0]
+    df_perf = wh.as_of(vr.ReportType.PERFORMANCE, as_of,
+                       latest_only=False).drop_duplicates()
+    df_role = wh.as_of(vr.ReportType.ROLE_DATE, as_of)
+    df_att_lt = wh.as_of(vr.ReportType.LEAVE_TAKEN, as_of)
+    df_att_pts = wh.as_of(vr.ReportType.LEAVE_ENT, as_of)
 
-    df_att_pts = pd.DataFrame()
-    if pts:
-        df_att_pts = [x.df for x in datasets \
-            if x.df_type == vr.ReportType.LEAVE_ENT][0]
+    groups = [(wh.as_of(vr.ReportType.EMPLOYEE_LIST, as_of, group=group), group)
+              for group in wh.groups(vr.ReportType.EMPLOYEE_LIST, as_of)]
 
-    groups = [(x.df, x.df_group) for x in datasets \
-        if x.df_type == vr.ReportType.EMPLOYEE_LIST]
+    wh.close()
 
-    for group in groups:
-        df_emp = group[0]
-        group_name = group[1]
+    return df_perf, df_role, df_att_lt, df_att_pts, groups
+
+
+def check_data(df_perf, df_role, df_att_lt, df_att_pts):
+    """
+    Returns a message naming the missing input data, or None if all the
+    data needed for a ranking is present
+    """
+    if df_perf.empty:
+        return 'No performance score data found.'
+    elif df_role.empty:
+        return 'No role date data found.'
+    elif df_att_lt.empty and df_att_pts.empty:
+        return 'No attendance data found.'
+    return None
 
-        print('\n\nCalculating ranking for {}\n'.format(group_name))
-        start_time = time.time()
 
+def compute_group(df_emp, group_name, df_att_lt, df_att_pts, df_role, df_perf,
+                  top_k=None):
+    """
+    Joins the employee data of one employee list group and ranks it
+
+    Returns:
+        df - Pandas DataFrame with the group's ranking
+    """
+    with mem_profile.stage('get_employee_data ' + group_name):
         df = vr.get_employee_data(df_emp, df_att_lt, df_att_pts, df_role, df_perf)
 
-        df = calculate_rank(df)
+    with mem_profile.stage('calculate_rank ' + group_name):
+        df = calculate_rank(df, top_k=top_k)
+
+    mem_profile.track('ranking ' + group_name, df)
+
+    return df
+
 
-        # first_two = [x[:2].upper() for x in group_name.split('_') if x.isalpha()]
-        # df['import_rank'] = df['rank'].apply(lambda x: ''.join(first_two) + '-' + '{0:0>3}'.format(x))
+def write_group(df, group_name, out_dir=None, verbose=True, top_k=None):
+    """
+    Saves the raw, distribution and points files of a group's ranking
+    """
+    # first_two = [x[:2].upper() for x in group_name.split('_') if x.isalpha()]
+    # df['import_rank'] = df['rank'].apply(lambda x: ''.join(first_two) + '-' + '{0:0>3}'.format(x))
 
-        # Reorder columns
-        df_dist = df[['payroll_number', 'last_name', 'first_name',
-                 'competency_score', 'capped_points', 'role_date', 'rank']]
+    # Reorder columns
+    df_dist = df[['payroll_number', 'last_name', 'first_name',
+             'competency_score', 'capped_points', 'role_date', 'rank']]
 
-        df_points = df[['payroll_number', 'last_name', 'first_name', 'position', 'points']]
+    df_points = df[['payroll_number', 'last_name', 'first_name', 'position', 'points']]
 
-        df = df[['payroll_number', 'last_name', 'first_name',
-                 'competency_score', 'points', 'capped_points', 'role_date', 'perf_scaled',
-                 'att_scaled', 'role_scaled', 'rank_scaled', 'rank']]
+    df_raw = df[['payroll_number', 'last_name', 'first_name',
+             'competency_score', 'points', 'capped_points', 'role_date', 'perf_scaled',
+             'att_scaled', 'role_scaled', 'rank_scaled', 'rank']]
 
-        print(df.head())
+    if verbose:
+        print(df_raw.head())
         print('\n')
-        print(df.info())
+        print(df_raw.info())
         print('\n')
-        print(df.describe())
+        print(df_raw.describe())
+
+    filename = (out_dir or OUTPUT_DIR) + pd.Timestamp.now().strftime('%Y%m%d%H%M') + \
+        '_' + group_name
+    if top_k is not None:
+        filename += '_top_{}'.format(top_k)
+
+    # Save raw file
+    df_raw.to_csv(filename + '_ranking_raw.csv', index=False) 
+
+    # Save distribution file
+    df_dist.to_csv(filename + '_ranking_dist.csv', index=False)
+
+    # Save total points file
+    df_points.to_csv(filename + '_points.csv', index=False)
+
+
+def rank_group(df_emp, group_name, df_att_lt, df_att_pts, df_role, df_perf,
+               out_dir=None, verbose=True, top_k=None):
+    """
+    Calculates the ranking of one employee list group and saves the raw,
+    distribution and points files
+
+    Args:
+        (pandas.DataFrame) df_emp - employee list of the group
+        (str) group_name - name of the group, used in the file names
+        (pandas.DataFrame) df_att_lt - leave taken data
+        (pandas.DataFrame) df_att_pts - leave entitlement data
+        (pandas.DataFrame) df_role - role date data
+        (pandas.DataFrame) df_perf - performance data
+        (str) out_dir - output directory, OUTPUT_DIR by default
+        (bool) verbose - print the head, info and description of the result
+        (int) top_k - rank and save only the first top_k employees
+    Returns:
+        df - Pandas DataFrame with the group's full ranking, or its first
+             top_k employees
+    """
+    print('\n\nCalculating ranking for {}\n'.format(group_name))
+    start_time = time.time()
+
+    df = compute_group(df_emp, group_name, df_att_lt, df_att_pts, df_role,
+                       df_perf, top_k)
+
+    write_group(df, group_name, out_dir, verbose, top_k)
+
+    print("\nRanking calculation took {} seconds.".format(time.time() - start_time))
 
-        filename = OUTPUT_DIR + pd.Timestamp.now().strftime('%Y%m%d%H%M') + \
-            '_' + group_name
+    return df
+
+
+def _rank_group_worker(df_emp, group_name, out_dir, verbose, top_k):
+    return rank_group(df_emp, group_name,
+                      shared_frames.get_frame('att_lt'),
+                      shared_frames.get_frame('att_pts'),
+                      shared_frames.get_frame('role'),
+                      shared_frames.get_frame('perf'),
+                      out_dir=out_dir, verbose=verbose, top_k=top_k)
+
+
+def rank_groups(groups, df_att_lt, df_att_pts, df_role, df_perf,
+                out_dir=None, processes=1, verbose=True, top_k=None):
+    """
+    Ranks every employee list group, optionally in a pool of worker
+    processes. The shared role, performance and leave frames are handed to
+    the workers through shared_frames instead of being pickled per group.
+
+    Args:
+        (list) groups - (employee list frame, group name) pairs
+        (pandas.DataFrame) df_att_lt - leave taken data
+        (pandas.DataFrame) df_att_pts - leave entitlement data
+        (pandas.DataFrame) df_role - role date data
+        (pandas.DataFrame) df_perf - performance data
+        (str) out_dir - output directory, OUTPUT_DIR by default
+        (int) processes - number of worker processes. 1 ranks the groups
+              in this process; None uses one per core.
+        (bool) verbose - print diagnostics for each group
+        (int) top_k - rank only the first top_k employees of each group
+    Returns:
+        list - the groups' rankings as Pandas DataFrames, in group order
+    """
+    if processes == 1 or len(groups) < 2:
+        return [rank_group(df_emp, group_name, df_att_lt, df_att_pts,
+                           df_role, df_perf, out_dir=out_dir, verbose=verbose,
+                           top_k=top_k)
+                for df_emp, group_name in groups]
+
+    frames = {'att_lt': df_att_lt, 'att_pts': df_att_pts,
+              'role': df_role, 'perf': df_perf}
+
+    with shared_frames.SharedStore(frames) as manifest_path:
+        pool = multiprocessing.Pool(processes, initializer=shared_frames.attach,
+                                    initargs=(manifest_path,))
+        try:
+            return pool.starmap(_rank_group_worker,
+                                [(df_emp, group_name, out_dir, verbose, top_k)
+                                 for df_emp, group_name in groups])
+        finally:
+            pool.close()
+            pool.join()
+
+
+def check_parallel(groups, df_att_lt, df_att_pts, df_role, df_perf,
+                   processes=2, top_k=None):
+    """
+    Ranks every group both in this process and in worker processes and
+    compares the results, to make sure the frames handed to the workers
+    give the same rankings. Files are written to a temporary directory.
+
+    Args:
+        (list) groups - (employee list frame, group name) pairs
+        (pandas.DataFrame) df_att_lt - leave taken data
+        (pandas.DataFrame) df_att_pts - leave entitlement data
+        (pandas.DataFrame) df_role - role date data
+        (pandas.DataFrame) df_perf - performance data
+        (int) processes - number of worker processes
+        (int) top_k - rank only the first top_k employees of each group
+    Returns:
+        list - names of the groups whose rankings differ
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        out_dir = tmp_dir + '/'
+        serial = rank_groups(groups, df_att_lt, df_att_pts, df_role, df_perf,
+                             out_dir=out_dir, processes=1, verbose=False,
+                             top_k=top_k)
+        parallel = rank_groups(groups, df_att_lt, df_att_pts, df_role, df_perf,
+                               out_dir=out_dir, processes=processes,
+                               verbose=False, top_k=top_k)
+
+    differing = []
+    for (df_emp, group_name), df_serial, df_parallel in zip(groups, serial, parallel):
+        try:
+            pd.testing.assert_frame_equal(df_serial, df_parallel)
+        except AssertionError as e:
+            print('\nRanking of {} differs between processes:\n{}'
+                  .format(group_name, e))
+            differing.append(group_name)
+
+    return differing
+
+
+def rank_pipelined(scan_dir=None, out_dir=None, verbose=True, top_k=None,
+                   queue_size=pipeline.QUEUE_SIZE):
+    """
+    Ranks every employee list group of the input files with reading,
+    ranking and writing overlapped.
+
+    The performance, role date and leave files are parsed on background
+    threads while the employee lists are read. Each group then flows
+    through read, rank and write stages connected by bounded queues, so the
+    next list is parsed and the previous ranking written while a group is
+    ranked, and no more than about queue_size groups wait between stages.
+    Employee lists are released once read and stored in the warehouse.
+    The memory profiler cannot attribute memory to stages running on
+    several threads, so it should not be enabled.
+
+    Args:
+        (str) scan_dir - directory of the input files, SCAN_DIR by default
+        (str) out_dir - output directory, OUTPUT_DIR by default
+        (bool) verbose - print diagnostics for each group
+        (int) top_k - rank only the first top_k employees of each group
+        (int) queue_size - groups held between two stages
+    Returns:
+        list - names of the ranked groups, or None if data is missing
+    """
+    cat = catalog.Catalog(scan_dir or SCAN_DIR, extensions=EXT, exclude_dirs=EXCLUDE_DIRS,
+                          dataset_cls=vr.Dataset)
+    cat.refresh()
+
+    datasets = cat.datasets()
+
+    start_time = time.time()
+
+    def newest(report_type):
+        ds = datasets.newest(report_type)
+        return ds.df if ds is not None else pd.DataFrame()
+
+    def load_perf():
+        return df_utils.append_dfs([x.df for x in
+                                    datasets.of_type(vr.ReportType.PERFORMANCE)])
+
+    executor = ThreadPoolExecutor(max_workers=4)
+    loads = [executor.submit(load_perf),
+             executor.submit(newest, vr.ReportType.ROLE_DATE),
+             executor.submit(newest, vr.ReportType.LEAVE_TAKEN),
+             executor.submit(newest, vr.ReportType.LEAVE_ENT)]
+    executor.shutdown(wait=False)
 
-        # Save raw file
-        df.to_csv(filename + '_ranking_raw.csv', index=False) 
+    emp_lists = datasets.of_type(vr.ReportType.EMPLOYEE_LIST)
+    handles = [emp_lists.newest(group=group) for group in emp_lists.groups()]
 
-        # Save distribution file
-        df_dist.to_csv(filename + '_ranking_dist.csv', index=False)
+    missing = []
 
-        # Save total points file
-        df_points.to_csv(filename + '_points.csv', index=False)
+    def read(ds):
+        df_emp = ds.df
+        warehouse.store_datasets([ds])
+        ds.df = None
+        return df_emp, ds.df_group
 
-        print("\nRanking calculation took {} seconds.".format(time.time() - start_time))
+    def compute(item):
+        df_emp, group_name = item
+        df_perf, df_role, df_att_lt, df_att_pts = [f.result() for f in loads]
+        message = check_data(df_perf, df_role, df_att_lt, df_att_pts)
+        if message:
+            missing.append(message)
+            return None
+
+        print('\n\nCalculating ranking for {}\n'.format(group_name))
+        group_start = time.time()
+        df = compute_group(df_emp, group_name, df_att_lt, df_att_pts,
+                           df_role, df_perf, top_k)
+        print('\nRanking {} took {} seconds.'.format(group_name,
+                                                     time.time() - group_start))
+        return df, group_name
+
+    def write(item):
+        df, group_name = item
+        write_group(df, group_name, out_dir, verbose, top_k)
+        return group_name
+
+    pipe = pipeline.Pipeline([pipeline.Stage('read', read),
+                              pipeline.Stage('rank', compute),
+                              pipeline.Stage('write', write)], queue_size)
+    ranked = pipe.run(handles)
+
+    # Make sure the shared files are parsed even without employee lists
+    for f in loads:
+        f.result()
+    warehouse.store_datasets(datasets.loaded())
+
+    print("\nPipelined ranking took {} seconds.".format(time.time() - start_time))
+
+    if missing:
+        print('\n' + missing[0])
+        return None
+
+    return ranked
+
+
+def _positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError('must be at least 1, got {}'.format(value))
+    return number
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Calculate employee rankings')
+    parser.add_argument('as_of', nargs='?',
+                        help='rank with the warehouse data as of this date')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of worker processes, 0 for one per core')
+    parser.add_argument('--check', action='store_true',
+                        help='rank in this process and in JOBS worker processes '
+                             '(2 by default) and compare the rankings')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='do not print diagnostics for each group')
+    parser.add_argument('-k', '--top', type=_positive_int,
+                        help='rank and save only the first TOP employees '
+                             'of each group')
+    parser.add_argument('-p', '--pipeline', action='store_true',
+                        help='overlap reading, ranking and writing of the groups '
+                             'on threads (input files only, not with as_of, '
+                             '--jobs or --mem-profile)')
+    parser.add_argument('-b', '--batch', action='store_true',
+                        help='quarantine employee lists with an unknown group '
+                             'instead of asking for it')
+    parser.add_argument('--mem-profile', action='store_true',
+                        help='record memory per stage and write a report')
+    parser.add_argument('--mem-budget', type=float,
+                        help='fail the run when memory peaks above this many MB')
+    args = parser.parse_args()
+
+    if args.pipeline:
+        # The pipeline reads the input files on several threads, which the
+        # memory profiler cannot tell apart
+        for option, used in [('as_of', args.as_of is not None),
+                             ('--jobs', args.jobs != 1),
+                             ('--check', args.check),
+                             ('--mem-profile', args.mem_profile),
+                             ('--mem-budget', args.mem_budget)]:
+            if used:
+                parser.error('--pipeline cannot be used with {}'.format(option))
+
+    create_dirs()
+
+    if args.batch:
+        vr.set_batch_mode()
+
+    if args.mem_profile or args.mem_budget:
+        mem_profile.profiler.start(args.mem_budget)
+
+    as_of = args.as_of
+
+    try:
+        if args.pipeline:
+            rank_pipelined(verbose=not args.quiet, top_k=args.top)
+        else:
+            if as_of is None:
+                df_perf, df_role, df_att_lt, df_att_pts, groups = load_files()
+            else:
+                df_perf, df_role, df_att_lt, df_att_pts, groups = load_warehouse(as_of)
+
+            missing = check_data(df_perf, df_role, df_att_lt, df_att_pts)
+            if missing:
+                print('\n' + missing)
+                sys.exit(0)
+
+            if args.check:
+                jobs = 2 if args.jobs == 1 else args.jobs or None
+                differing = check_parallel(groups, df_att_lt, df_att_pts, df_role,
+                                           df_perf, processes=jobs, top_k=args.top)
+                print('\nRankings differ for: {}'.format(', '.join(differing))
+                      if differing else '\nRankings are identical.')
+                sys.exit(1 if differing else 0)
+
+            rank_groups(groups, df_att_lt, df_att_pts, df_role, df_perf,
+                        processes=args.jobs or None, verbose=not args.quiet,
+                        top_k=args.top)
+    finally:
+        if mem_profile.profiler.enabled:
+            filename = OUTPUT_DIR + pd.Timestamp.now().strftime('%Y%m%d%H%M') + \
+                '_memory_profile.txt'
+            print(mem_profile.profiler.report(filename))
+            mem_profile.profiler.stop()
 
     # Open output directory
-    os.startfile(OUTPUT_DIR)
\ No newline at end of file
+    os.startfile(OUTPUT_DIR)
+
+
+if __name__ == '__main__':
+    main()
@@ -17,7 +17,7 @@ in_dir = CUR_DIR + '/data/rank/'
 EXCLUDE_DIRS = ['old']
 
 # Extensions to include in file list
-EXT = (('.xls', '.xlsx', '.csv', '.htm'))
+EXT = (('.xls', '.xlsx', '.csv', '.htm', '.csv.gz', '.htm.gz', '.zip'))
 
 # Set pandas to display all columns
 pd.set_option('display.max_columns', None)
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+import pandas as pd
+import numpy as np
+import file_utils, rank, vr
+import argparse, csv, heapq, os, shutil, sys, tempfile, time
+
+# Current working directory
+CURRENT_DIR = os.getcwd()
+
+# Output directory - change to desired location
+OUTPUT_DIR = CURRENT_DIR + '/output/rank/'
+
+# Number of employees held in memory at a time
+CHUNK_SIZE = 50000
+
+# Maximum number of sorted runs merged at once
+MAX_OPEN_RUNS = 64
+
+EMPLOYEE_COLS = ['payroll_number', 'last_name', 'first_name', 'position',
+                 'role_date', 'competency_score', 'points']
+
+RANK_COLS = ['payroll_number', 'last_name', 'first_name', 'position',
+             'competency_score', 'points', 'capped_points', 'role_date',
+             'perf_scaled', 'att_scaled', 'role_scaled', 'rank_scaled']
+
+KEY_COLS = ['tier', 'key_1', 'key_2', 'key_3']
+
+
+def _read_chunks(path, chunk_size):
+    return pd.read_csv(path, chunksize=chunk_size,
+                       dtype={'payroll_number': str},
+                       parse_dates=['role_date'])
+
+
+def _read_text_chunks(path, chunk_size):
+    # Read as text, so dates are parsed with the report's formats and
+    # payroll numbers keep their leading zeros
+    return pd.read_csv(path, chunksize=chunk_size, dtype=str)
+
+
+def _leave_taken_points(lt_path, df_role, chunk_size):
+    totals = None
+    for chunk in _read_text_chunks(lt_path, chunk_size):
+        chunk_totals = vr.leave_taken_points(chunk, df_role)
+        if totals is not None:
+            chunk_totals = pd.concat([totals, chunk_totals], ignore_index=True,
+                                     sort=False)
+            chunk_totals = chunk_totals.groupby(['payroll_number']).sum() \
+                .reset_index()
+        totals = chunk_totals
+
+    return totals
+
+
+def write_employee_data(emp_path, lt_path, df_att_pts, df_role, df_perf,
+                        path, chunk_size=CHUNK_SIZE):
+    """
+    Builds the table of vr.get_employee_data for an employee list stored on
+    disk and writes it to a CSV file, so the joined frames never hold more
+    than chunk_size employees
+
+    The role date, performance and leave entitlement data are reduced to one
+    row per employee once, and the leave taken events are read in chunks
+    once to total each employee's points, before the employee list is read
+    and joined in chunks.
+
+    Args:
+        (str) emp_path - CSV file of the employee list
+        (str) lt_path - CSV file of leave taken data, None if there is none
+        (pandas.DataFrame) df_att_pts - leave entitlement data
+        (pandas.DataFrame) df_role - role date data
+        (pandas.DataFrame) df_perf - performance data
+        (str) path - CSV file to write
+        (int) chunk_size - number of employees or leave taken rows held in
+              memory at a time
+    """
+    df_role = vr.latest_role_dates(df_role)
+    df_perf = vr.latest_performance(df_perf)
+    if not df_att_pts.empty:
+        df_att_pts = vr.latest_total_points(df_att_pts)
+
+    df_points = None
+    if lt_path is not None:
+        df_points = _leave_taken_points(lt_path, df_role, chunk_size)
+
+    header = True
+    for chunk in _read_text_chunks(emp_path, chunk_size):
+        df = vr.format_employee_list(chunk)
+        df = vr.add_role_dates(df, df_role)
+        df = vr.merge_performance(df, df_perf)
+        if df_points is not None:
+            df = pd.merge(df, df_points, how='left', on='payroll_number')
+        if not df_att_pts.empty:
+            df = vr.add_total_points(df, df_att_pts)
+        df = vr.fill_employee_data(df)
+
+        df = df.reindex(columns=EMPLOYEE_COLS)
+        df.to_csv(path, mode='w' if header else 'a', header=header, index=False)
+        header = False
+
+
+def _fold(current, value, pick):
+    # Skips the NaN or NaT of a chunk with no values
+    if pd.isnull(value):
+        return current
+    if current is None:
+        return value
+    return pick(current, value)
+
+
+def _roster_stats(path, chunk_size):
+    max_score = None
+    min_date = None
+    max_date = None
+
+    for chunk in _read_chunks(path, chunk_size):
+        max_score = _fold(max_score, chunk['competency_score'].max(), max)
+        min_date = _fold(min_date, chunk['role_date'].min(), min)
+        max_date = _fold(max_date, chunk['role_date'].max(), max)
+
+    return max_score, (min_date, max_date)
+
+
+def _sort_keys(df, weights):
+    df = df.copy()
+    df['rank_scaled'] = df['perf_scaled'] * weights[0] + df['att_scaled'] \
+        * weights[1] + df['role_scaled'] * weights[2]
+
+    tiers = []
+    for tier, df_tier in enumerate(rank.split_tiers(df)):
+        df_tier = df_tier.copy()
+        df_tier['tier'] = tier
+        if tier == 0:
+            # Employees with an eval score are ordered by rank score, then
+            # seniority, then attendance, as in rank.calculate_rank
+            df_tier['key_1'] = -df_tier['rank_scaled']
+            df_tier['key_2'] = -df_tier['role_scaled']
+            df_tier['key_3'] = -df_tier['att_scaled']
+        else:
+            # The others by seniority, then attendance
+            df_tier['key_1'] = -df_tier['role_scaled']
+            df_tier['key_2'] = -df_tier['att_scaled']
+            df_tier['key_3'] = 0.0
+        tiers.append(df_tier)
+
+    df = pd.concat(tiers, ignore_index=True, sort=False)
+    keys = ['key_1', 'key_2', 'key_3']
+    df[keys] = df[keys].fillna(np.inf)
+
+    return df.sort_values(by=KEY_COLS + ['payroll_number'])
+
+
+def _row_key(row):
+    return (int(row[0]), float(row[1]), float(row[2]), float(row[3]), row[4])
+
+
+def _read_run(path):
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        next(reader)
+        for row in reader:
+            yield row
+
+
+def _merge_runs(paths, out_path, header):
+    runs = [_read_run(p) for p in paths]
+    with open(out_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(heapq.merge(*runs, key=_row_key))
+
+
+def calculate_rank(in_path, out_path, chunk_size=CHUNK_SIZE,
+                   max_open_runs=MAX_OPEN_RUNS, weights=(0.7, 0.2, 0.1),
+                   tmp_dir=None):
+    """
+    Calculates the employee ranking of a roster stored on disk without
+    loading it into memory at once.
+
+    The roster is read twice in chunks: first to find the score and role
+    date ranges used for scaling, then to compute the scaled scores of each
+    chunk and write it as a sorted run. The runs are combined with an
+    external merge sort into the same three-tier order as
+    rank.calculate_rank.
+
+    Args:
+        (str) in_path - CSV file with the columns of vr.get_employee_data
+        (str) out_path - CSV file to write the ranking to
+        (int) chunk_size - number of employees held in memory at a time
+        (int) max_open_runs - maximum number of runs merged at once
+        (tuple) weights - eval, attendance and role date weights
+        (str) tmp_dir - directory for the sorted runs, system default if None
+    Returns:
+        int - number of ranked rows
+    """
+    max_score, role_dates = _roster_stats(in_path, chunk_size)
+
+    work_dir = tempfile.mkdtemp(dir=tmp_dir)
+    try:
+        header = KEY_COLS + RANK_COLS
+        runs = []
+        for chunk in _read_chunks(in_path, chunk_size):
+            chunk = rank.scale_scores(chunk, max_score=max_score,
+                                      role_dates=role_dates)
+            chunk = _sort_keys(chunk, weights)
+            chunk = chunk.reindex(columns=KEY_COLS + RANK_COLS)
+
+            run = os.path.join(work_dir, 'run_{}.csv'.format(len(runs)))
+            chunk.to_csv(run, index=False, float_format='%.17g')
+            runs.append(run)
+
+        # Merge in passes so no more than max_open_runs files are open
+        while len(runs) > max_open_runs:
+            merged = []
+            for i in range(0, len(runs), max_open_runs):
+                run = os.path.join(work_dir, 'merge_{}_{}.csv'
+                                   .format(len(runs), len(merged)))
+                _merge_runs(runs[i:i + max_open_runs], run, header)
+                merged.append(run)
+            runs = merged
+
+        # Final merge drops the sort keys and adds the rank
+        rows = heapq.merge(*[_read_run(p) for p in runs], key=_row_key)
+        count = 0
+        with open(out_path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(RANK_COLS + ['rank'])
+            for count, row in enumerate(rows, 1):
+                writer.writerow(row[len(KEY_COLS):] + [count])
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return count
+
+
+def check_rank(in_path, chunk_size=CHUNK_SIZE, weights=(0.7, 0.2, 0.1)):
+    """
+    Ranks a roster both in memory with rank.calculate_rank and out of core,
+    and compares the order of the two rankings
+
+    Args:
+        (str) in_path - CSV file with the columns of vr.get_employee_data
+        (int) chunk_size - number of employees held in memory at a time
+        (tuple) weights - eval, attendance and role date weights
+    Returns:
+        bool - True if both rankings give the same order
+    """
+    df = pd.read_csv(in_path, dtype={'payroll_number': str},
+                     parse_dates=['role_date'])
+    df = rank.calculate_rank(df, *weights)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        out_path = os.path.join(tmp_dir, 'ranking.csv')
+        calculate_rank(in_path, out_path, chunk_size, weights=weights,
+                       tmp_dir=tmp_dir)
+        df_ooc = pd.read_csv(out_path, dtype={'payroll_number': str})
+
+    try:
+        pd.testing.assert_series_equal(df['payroll_number'],
+                                       df_ooc['payroll_number'])
+    except AssertionError as e:
+        print('\nOut-of-core ranking differs from rank.calculate_rank:\n{}'
+              .format(e))
+        return False
+
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Calculate employee rankings '
+                                     'out of core')
+    parser.add_argument('chunk_size', nargs='?', type=rank._positive_int,
+                        default=CHUNK_SIZE,
+                        help='number of employees held in memory at a time')
+    parser.add_argument('--check', action='store_true',
+                        help='compare each ranking with rank.calculate_rank')
+    args = parser.parse_args()
+
+    file_utils.create_dir(OUTPUT_DIR)
+
+    df_perf, df_role, df_att_lt, df_att_pts, groups = rank.load_files()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        lt_path = None
+        if not df_att_lt.empty:
+            lt_path = os.path.join(tmp_dir, 'leave_taken.csv')
+            df_att_lt.to_csv(lt_path, index=False)
+
+        for df_emp, group_name in groups:
+            print('\n\nCalculating ranking for {}\n'.format(group_name))
+            start_time = time.time()
+
+            filename = OUTPUT_DIR + pd.Timestamp.now().strftime('%Y%m%d%H%M') + \
+                '_' + group_name
+
+            emp_path = os.path.join(tmp_dir, 'employee_list.csv')
+            df_emp.to_csv(emp_path, index=False)
+
+            write_employee_data(emp_path, lt_path, df_att_pts, df_role, df_perf,
+                                filename + '_employee_data.csv', args.chunk_size)
+
+            count = calculate_rank(filename + '_employee_data.csv',
+                                   filename + '_ranking_raw.csv', args.chunk_size)
+
+            print('Ranked {} employees.'.format(count))
+
+            print("\nRanking calculation took {} seconds.".format(time.time() - start_time))
+
+            if args.check and not check_rank(filename + '_employee_data.csv',
+                                             args.chunk_size):
+                sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
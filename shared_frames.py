@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+import pandas as pd
+import numpy as np
+import json, os, shutil, tempfile
+
+MANIFEST_FILE = 'manifest.json'
+
+# infer_dtype results of object columns stored as codes into their
+# distinct values. Values of one type only compare equal when they are the
+# same value, so mapping codes back gives the original objects.
+CODED_TYPES = ('string', 'unicode', 'bytes', 'empty', 'floating', 'integer',
+               'boolean', 'datetime', 'date', 'decimal')
+
+# Frames attached in this process, set by attach() in worker processes
+_attached = None
+
+_frames = {}
+
+
+def _is_native(series):
+    values = series.values
+    return isinstance(values, np.ndarray) and values.dtype.kind in 'biufcmM'
+
+
+def _export_object(series, path):
+    if series.dtype.name == 'category':
+        np.save(path, np.asarray(series.cat.codes.values))
+        np.save(path + '_values', np.asarray(series.cat.categories, dtype=object),
+                allow_pickle=True)
+        return {'kind': 'category', 'ordered': bool(series.cat.ordered)}
+
+    values = series.astype(object)
+    if pd.api.types.infer_dtype(values, skipna=True) in CODED_TYPES:
+        # Python objects cannot be memory-mapped, so repetitive values such
+        # as positions are stored as mapped codes into their distinct values
+        codes, uniques = pd.factorize(values)
+        np.save(path, codes.astype(np.int32))
+        np.save(path + '_values', np.asarray(uniques, dtype=object),
+                allow_pickle=True)
+        return {'kind': 'coded'}
+
+    # Mixed types such as 2 and 2.5 in one column are kept as they are
+    np.save(path, np.asarray(values.values, dtype=object), allow_pickle=True)
+    return {'kind': 'object'}
+
+
+def export_frames(frames, directory):
+    """
+    Writes the column buffers of DataFrames to .npy files once, so worker
+    processes can memory-map them instead of receiving pickled copies.
+
+    Numeric and date columns of the same dtype are written together as one
+    2-D block, the layout pandas keeps them in, so a worker can wrap the
+    mapped block in a DataFrame without copying it. Other columns are
+    written with their dtype, so they come back with the values and types
+    they had.
+
+    Args:
+        (dict) frames - Pandas DataFrames by name
+        (str) directory - directory to write the buffers and manifest to
+    Returns:
+        str - path of the manifest to pass to attach()
+    """
+    manifest = {}
+    for name, df in frames.items():
+        frame_dir = os.path.join(directory, name)
+        os.makedirs(frame_dir, exist_ok=True)
+
+        columns = []
+        native = {}
+        for i, column in enumerate(df.columns):
+            series = df.iloc[:, i]
+            info = {'name': str(column), 'dtype': str(series.dtype)}
+            if _is_native(series):
+                native.setdefault(series.dtype.str, []).append(i)
+                info['kind'] = 'array'
+            else:
+                path = os.path.join(frame_dir, 'c{}'.format(i))
+                info.update(_export_object(series, path), file=path + '.npy')
+            columns.append(info)
+
+        blocks = []
+        for dtype, positions in native.items():
+            path = os.path.join(frame_dir, 'b{}.npy'.format(len(blocks)))
+            block = np.empty((len(positions), len(df)), dtype=dtype)
+            for pos, i in enumerate(positions):
+                block[pos] = df.iloc[:, i].values
+                columns[i].update(block=len(blocks), pos=pos)
+            np.save(path, block)
+            blocks.append({'file': path, 'dtype': dtype})
+
+        manifest[name] = {'rows': len(df), 'columns': columns, 'blocks': blocks}
+
+    manifest_path = os.path.join(directory, MANIFEST_FILE)
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f)
+
+    return manifest_path
+
+
+class SharedFrames:
+    """
+    Read-only view of frames written by export_frames. Numeric and date
+    blocks are memory-mapped, so every process attached to the same
+    manifest shares the operating system's page cache instead of holding
+    its own copy.
+    """
+
+    def __init__(self, manifest_path):
+        self.manifest_path = manifest_path
+        with open(manifest_path) as f:
+            self.manifest = json.load(f)
+        self._blocks = {}
+
+    def names(self):
+        return list(self.manifest)
+
+    def _block(self, name, block):
+        if (name, block) not in self._blocks:
+            info = self.manifest[name]['blocks'][block]
+            self._blocks[(name, block)] = np.load(info['file'], mmap_mode='r')
+        return self._blocks[(name, block)]
+
+    def _info(self, name, column):
+        for info in self.manifest[name]['columns']:
+            if info['name'] == column:
+                return info
+        raise KeyError(column)
+
+    def _decode(self, info):
+        if info['kind'] == 'object':
+            values = np.load(info['file'], allow_pickle=True)
+        else:
+            codes = np.load(info['file'], mmap_mode='r')
+            uniques = np.load(info['file'][:-4] + '_values.npy', allow_pickle=True)
+            if info['kind'] == 'category':
+                return pd.Categorical.from_codes(codes, uniques,
+                                                 ordered=info['ordered'])
+
+            # Code -1 marks a missing value
+            values = uniques.take(np.maximum(codes, 0)) if len(uniques) \
+                else np.empty(len(codes), dtype=object)
+            values[codes < 0] = np.nan
+
+        if info['dtype'] != 'object':
+            values = pd.Series(values).astype(info['dtype']).values
+        return values
+
+    def column(self, name, column):
+        """
+        Returns one column. Numeric and date columns are read-only
+        memory-mapped arrays; other columns are decoded to their dtype.
+        """
+        info = self._info(name, column)
+        if info['kind'] == 'array':
+            return self._block(name, info['block'])[info['pos']]
+        return self._decode(info)
+
+    def frame(self, name, columns=None):
+        """
+        Builds a DataFrame from the shared buffers. Numeric and date
+        columns stay in the mapped blocks without being copied; they come
+        first, grouped by dtype, since putting them back in their original
+        order would copy the blocks.
+
+        Args:
+            (str) name - name of the frame
+            (list) columns - columns to include, all columns if None
+        Returns:
+            df - Pandas DataFrame of the requested columns
+        """
+        frame_info = self.manifest[name]
+        if columns is None:
+            columns = [c['name'] for c in frame_info['columns']]
+        infos = [self._info(name, column) for column in columns]
+        index = pd.RangeIndex(frame_info['rows'])
+
+        parts = []
+        for block in range(len(frame_info['blocks'])):
+            selected = [info for info in infos
+                        if info['kind'] == 'array' and info['block'] == block]
+            if not selected:
+                continue
+            values = self._block(name, block)
+            positions = [info['pos'] for info in selected]
+            if positions != list(range(len(values))):
+                values = values[positions]
+            parts.append(pd.DataFrame(values.T, index=index, copy=False,
+                                      columns=[info['name'] for info in selected]))
+
+        # Object columns are decoded into one block of their own
+        objects = [info for info in infos if info['kind'] in ('coded', 'object')
+                   and info['dtype'] == 'object']
+        if objects:
+            values = np.empty((len(objects), frame_info['rows']), dtype=object)
+            for i, info in enumerate(objects):
+                values[i] = self._decode(info)
+            parts.append(pd.DataFrame(values.T, index=index, copy=False,
+                                      columns=[info['name'] for info in objects]))
+
+        for info in infos:
+            if info['kind'] != 'array' and info not in objects:
+                parts.append(pd.DataFrame({info['name']: self._decode(info)},
+                                          index=index))
+
+        if not parts:
+            return pd.DataFrame(index=index)
+        return pd.concat(parts, axis=1, copy=False)
+
+
+class SharedStore:
+    """
+    Context manager that exports frames to a temporary directory and
+    removes it on exit
+
+        with SharedStore({'role': df_role}) as manifest_path:
+            pool = multiprocessing.Pool(initializer=attach,
+                                        initargs=(manifest_path,))
+    """
+
+    def __init__(self, frames, tmp_dir=None):
+        self.frames = frames
+        self.tmp_dir = tmp_dir
+        self.directory = None
+
+    def __enter__(self):
+        self.directory = tempfile.mkdtemp(dir=self.tmp_dir)
+        return export_frames(self.frames, self.directory)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def attach(manifest_path):
+    """
+    Attaches the current process to exported frames. Meant to be used as a
+    multiprocessing.Pool initializer.
+    """
+    global _attached
+    _attached = SharedFrames(manifest_path)
+    _frames.clear()
+
+
+def get_frame(name):
+    """
+    Returns an attached frame. Each worker builds a frame once and reuses
+    it for all of its tasks.
+    """
+    if name not in _frames:
+        _frames[name] = _attached.frame(name)
+    return _frames[name]
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+import pandas as pd
+import file_utils, df_utils, rank, vr
+import multiprocessing, os, sys, time, traceback
+
+# Current working directory
+CUR_DIR = os.getcwd()
+
+# File listing one site input directory per line
+CONFIGURATION = CUR_DIR + '/sites.conf'
+
+# Output directory - each site gets its own sub directory
+out_dir = CUR_DIR + '/output/sites/'
+
+SUMMARY_COLS = ['site', 'community', 'group', 'position']
+
+# Only rank.py's rankings are run per site. points.py and employee.py read
+# the single input directory of their configuration files.
+
+
+def read_sites(path=CONFIGURATION):
+    """
+    Reads the site input directories from a file, one per line. Blank lines
+    and lines starting with # are skipped.
+    """
+    with open(path) as f:
+        return [line.strip() for line in f
+                if line.strip() and not line.strip().startswith('#')]
+
+
+def site_name(site_dir):
+    return os.path.basename(os.path.normpath(site_dir))
+
+
+def run_site(site_dir, out_root):
+    """
+    Ranks every employee list group of one site. Runs in a worker process;
+    an error only fails its own site.
+
+    Args:
+        (str) site_dir - input directory of the site
+        (str) out_root - output directory; the site's files go in a sub
+              directory named after the site
+    Returns:
+        tuple - site name, a Pandas DataFrame with the rankings of all the
+                site's groups, and the reason the site was not ranked. The
+                DataFrame is None if the site failed or has missing data.
+    """
+    name = site_name(site_dir)
+    try:
+        return _rank_site(name, site_dir, out_root)
+    except Exception as e:
+        print('\n{} failed:\n{}'.format(name, traceback.format_exc()))
+        return name, None, '{}: {}'.format(type(e).__name__, e)
+
+
+def _rank_site(name, site_dir, out_root):
+    site_out_dir = out_root + name + '/'
+    file_utils.create_dir(site_out_dir)
+
+    df_perf, df_role, df_att_lt, df_att_pts, groups = rank.load_files(site_dir)
+
+    missing = rank.check_data(df_perf, df_role, df_att_lt, df_att_pts)
+    if missing:
+        print('\n{}: {}'.format(name, missing))
+        return name, None, missing
+
+    dfs = []
+    for df_emp, group_name in groups:
+        df = rank.rank_group(df_emp, group_name, df_att_lt, df_att_pts,
+                             df_role, df_perf, out_dir=site_out_dir,
+                             verbose=False)
+        df['group'] = group_name
+        dfs.append(df)
+
+    if not dfs:
+        return name, None, 'No employee lists found.'
+
+    return name, pd.concat(dfs, ignore_index=True, sort=False), None
+
+
+def summarize(df, positions, failed=()):
+    """
+    Summarizes the rankings of all sites per site, community, group and
+    position. The community comes from the communities column of
+    positions.csv and defaults to the site name. Sites that were not ranked
+    get a row of their own with the reason in the error column.
+    """
+    positions = positions[['position', 'communities']].drop_duplicates('position')
+    df = pd.merge(df, positions, how='left', on='position')
+    df['community'] = df['communities'].fillna(df['site'])
+    df['position'] = df['position'].fillna('')
+
+    df['has_score'] = df['competency_score'] > 0
+
+    summary = df.groupby(SUMMARY_COLS).agg({'payroll_number': 'count',
+                                             'has_score': 'sum',
+                                             'competency_score': 'mean',
+                                             'points': 'mean',
+                                             'rank_scaled': 'mean'})
+    summary = summary.rename(columns={'payroll_number': 'employees',
+                                      'has_score': 'with_score',
+                                      'competency_score': 'mean_competency_score',
+                                      'points': 'mean_points',
+                                      'rank_scaled': 'mean_rank_scaled'})
+    summary = summary.reset_index()
+
+    summary['error'] = ''
+    if failed:
+        df_failed = pd.DataFrame(list(failed), columns=['site', 'error'])
+        df_failed['employees'] = 0
+        summary = pd.concat([summary, df_failed], ignore_index=True, sort=False)
+        summary[SUMMARY_COLS] = summary[SUMMARY_COLS].fillna('')
+
+    return summary
+
+
+def run_sites(site_dirs, out_root=None, processes=None, batch=True):
+    """
+    Ranks several sites in parallel, one worker process per site, and
+    writes a consolidated cross-site ranking and summary. Sites that fail
+    or have missing data are listed in the summary and do not stop the
+    others.
+
+    Args:
+        (list) site_dirs - input directories of the sites
+        (str) out_root - output directory, out_dir by default
+        (int) processes - number of worker processes, one per core if None
+        (bool) batch - quarantine employee lists with an unknown group
+               instead of prompting for it
+    Returns:
+        summary - Pandas DataFrame with the cross-site summary
+    """
+    out_root = out_root or out_dir
+    file_utils.create_dir(out_root)
+
+    if batch:
+        vr.set_batch_mode()
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.starmap(run_site, [(d, out_root) for d in site_dirs])
+    finally:
+        pool.close()
+        pool.join()
+
+    dfs = []
+    failed = []
+    for name, df, error in results:
+        if df is not None:
+            df['site'] = name
+            dfs.append(df)
+        else:
+            failed.append((name, error))
+
+    if dfs:
+        df = pd.concat(dfs, ignore_index=True, sort=False)
+    else:
+        df = pd.DataFrame(columns=['site', 'position', 'group', 'payroll_number',
+                                   'competency_score', 'points', 'rank_scaled'])
+
+    positions = df_utils.load_data(CUR_DIR + '/positions.csv')
+    summary = summarize(df, positions, failed)
+
+    filename = out_root + pd.Timestamp.now().strftime('%Y%m%d%H%M')
+
+    df.to_csv(filename + '_all_sites_ranking.csv', index=False)
+    summary.to_csv(filename + '_all_sites_summary.csv', index=False)
+
+    return summary
+
+
+if __name__ == '__main__':
+    site_dirs = sys.argv[1:] or read_sites()
+
+    start_time = time.time()
+
+    summary = run_sites(site_dirs)
+
+    print(summary)
+
+    failed = summary[summary['error'] != '']
+    if not failed.empty:
+        print('\n{} sites were not ranked:'.format(len(failed)))
+        for site, error in zip(failed['site'], failed['error']):
+            print('{}: {}'.format(site, error))
+
+    report = vr.QUARANTINE_DIR + vr.QUARANTINE_REPORT
+    if os.path.isfile(report):
+        print('\nQuarantined files are listed in {}'.format(report))
+
+    print("\nRanking {} sites took {} seconds.".format(len(site_dirs), time.time() - start_time))
@@ -1,7 +1,126 @@
 #!/usr/bin/env python3
-import file_utils, df_utils
+import catalog, file_utils, df_utils, date_utils, mem_profile
 import pandas as pd
 import numpy as np
+import csv, json, os, shutil, time
+
+# Current working directory
+CUR_DIR = os.getcwd()
+
+# Persisted file hash and header text to group name mapping
+GROUP_MAP_FILE = CUR_DIR + '/group_map.json'
+
+# Employee lists whose group cannot be resolved in batch mode are moved here
+QUARANTINE_DIR = CUR_DIR + '/data/quarantine/'
+
+QUARANTINE_REPORT = 'quarantine.csv'
+
+# In batch mode unresolved groups are quarantined instead of prompted for.
+# Set through the environment so worker processes inherit it.
+BATCH_MODE_VAR = 'RANK_BATCH_MODE'
+
+
+def set_batch_mode(enabled=True):
+    os.environ[BATCH_MODE_VAR] = '1' if enabled else '0'
+
+
+def batch_mode():
+    return os.environ.get(BATCH_MODE_VAR) == '1'
+
+
+def load_group_map(path=GROUP_MAP_FILE):
+    """
+    Reads the persisted group mapping: file content hashes and header
+    texts, each mapped to a group name. Files are keyed by hash since
+    employee lists of different sites often share a file name.
+    """
+    group_map = {'files': {}, 'headers': {}}
+    if os.path.isfile(path):
+        with open(path) as f:
+            group_map.update(json.load(f))
+    return group_map
+
+
+def save_group_map(group_map, path=GROUP_MAP_FILE):
+    with open(path, 'w') as f:
+        json.dump(group_map, f, indent=1, sort_keys=True)
+
+
+def infer_group(header, filepath, group_map):
+    """
+    Resolves the group of an employee list from, in order, the mapped file
+    hash, the mapped header text and a position or department name in the
+    header
+
+    Args:
+        (str) header - header cell naming the group
+        (str) filepath - path of the employee list
+        (dict) group_map - mapping from load_group_map
+    Returns:
+        str - group name, or None if no rule applies
+    """
+    if group_map['files']:
+        file_hash = catalog.hash_file(filepath)
+        if file_hash in group_map['files']:
+            return group_map['files'][file_hash]
+
+    if header in group_map['headers']:
+        return group_map['headers'][header]
+
+    for group_type in ['position', 'department']:
+        if group_type in header:
+            return header.split('.')[0].strip(' {}'.format(group_type)) \
+                .split('the ')[-1].replace(' ', '_').replace('/', '').lower()
+
+    return None
+
+
+def quarantined_files():
+    """
+    Returns the paths recorded in the quarantine report
+    """
+    report = QUARANTINE_DIR + QUARANTINE_REPORT
+    if not os.path.isfile(report):
+        return set()
+    with open(report, newline='') as f:
+        return set(row['file'] for row in csv.DictReader(f))
+
+
+def quarantine(filepath, reason, header=''):
+    """
+    Moves an input file to QUARANTINE_DIR and records it in the quarantine
+    report so a batch run can go on without it. The report gives the file's
+    hash, the key to map it to a group with in group_map.json.
+    """
+    file_utils.create_dir(QUARANTINE_DIR)
+
+    file_hash = catalog.hash_file(filepath)
+
+    target = QUARANTINE_DIR + os.path.basename(filepath)
+    if os.path.exists(target):
+        name, ext = os.path.splitext(target)
+        target = '{}_{}{}'.format(name, time.strftime('%Y%m%d%H%M%S'), ext)
+
+    if file_utils.split_archive_path(filepath)[1] is None:
+        shutil.move(filepath, target)
+    else:
+        # Archive members are copied out as stored, the archive is left in
+        # place; later runs find the member in the report and leave it
+        with file_utils.open_data(filepath, raw=True) as src, \
+                open(target, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+
+    report = QUARANTINE_DIR + QUARANTINE_REPORT
+    new_report = not os.path.isfile(report)
+    with open(report, 'a', newline='') as f:
+        writer = csv.writer(f)
+        if new_report:
+            writer.writerow(['time', 'file', 'moved_to', 'reason', 'header',
+                             'hash'])
+        writer.writerow([time.strftime('%Y-%m-%d %H:%M:%S'), filepath, target,
+                         reason, header, file_hash])
+
+    print('\nQuarantined {}: {}'.format(filepath, reason))
 
 
 class ReportType:
@@ -33,18 +152,69 @@ class Dataset:
                     'test_attendance_points': 'points',
                     'roles': 'position'}
 
-    def __init__(self, filepath):
+    def __init__(self, filepath, df_type=None, df_group=None,
+                 snapshot_date=None):
+        """
+        Args:
+            (str) filepath - path of the input file
+            (str) df_type - report type, if already known from the catalog.
+                  The file is then only parsed when df is first accessed.
+            (str) df_group - employee list group, if already known
+            (date) snapshot_date - date the export was taken, if known
+        """
         self.filepath = filepath
-        self.filetype = filepath.split('.')[-1]
+        self.filetype = file_utils.data_name(filepath).split('.')[-1]
+
+        self.df_group = df_group
+        self.df_type = df_type
+        self.snapshot_date = snapshot_date
+
+        self._df = None
+
+        if self.df_type is None:
+            self._load()
+
+    @property
+    def df(self):
+        if self._df is None:
+            self._load()
+        return self._df
+
+    @df.setter
+    def df(self, value):
+        self._df = value
+
+    @property
+    def loaded(self):
+        return self._df is not None
+
+    @staticmethod
+    def rules_mtime():
+        """
+        Returns the mtime of the group map, None if there is none. Employee
+        lists quarantined for an unknown group are catalogued without a
+        report type, so the catalog identifies such files again when the
+        map changes.
+        """
+        if not os.path.isfile(GROUP_MAP_FILE):
+            return None
+        return os.stat(GROUP_MAP_FILE).st_mtime
+
+    def _load(self):
+        with mem_profile.stage('load_data', self.filepath):
+            self._df = df_utils.load_data(self.filepath)
+        
+        with mem_profile.stage('identify_data', self.filepath):
+            self._identify_data()
 
-        self.df_group = None
-        self.df_type = None
+        if self.df_type == ReportType.EMPLOYEE_LIST and self.df_group is None:
+            # Quarantined in batch mode
+            self.df_type = None
 
-        self.df = df_utils.load_data(filepath)
-        
-        self._identify_data()
+        with mem_profile.stage('format_dataset', self.filepath):
+            self._format_dataset()
 
-        self._format_dataset()
+        mem_profile.track(self.filepath, self._df)
 
     
     def _identify_data(self):
@@ -58,7 +228,7 @@ class Dataset:
                         self.df_type = report.name
                         df_index = i
 
-            if self.df_type == ReportType.EMPLOYEE_LIST:
+            if self.df_type == ReportType.EMPLOYEE_LIST and self.df_group is None:
                 self.df_group = self._get_group()
 
 
@@ -71,7 +241,7 @@ class Dataset:
                     if len(row) != 0:
                         header_row = row[0]
 
-            if self.df_type == ReportType.EMPLOYEE_LIST:
+            if self.df_type == ReportType.EMPLOYEE_LIST and self.df_group is None:
                 self.df_group = self._get_group()
 
         if header_row:
@@ -83,24 +253,25 @@ class Dataset:
     
     def _get_group(self):
         if self.filetype == self.HTM_EXT:
-            group = self.df[0].iloc[0, 1]
+            header = self.df[0].iloc[0, 1]
         else:
-            group = self.df.iloc[2, 1]
-
-        group_type = ''
+            header = self.df.iloc[2, 1]
+        header = '' if pd.isnull(header) else str(header)
 
-        if 'position' in group:
-            group_type = 'position'
-        elif 'department' in group:
-            group_type = 'department'
+        group_map = load_group_map()
+        group = infer_group(header, self.filepath, group_map)
 
-        if not group_type:
+        if group is None and batch_mode():
+            if self.filepath not in quarantined_files():
+                quarantine(self.filepath, 'group name not found', header)
+        elif group is None:
             print('\nGroup name not found for: {}'.format(self.filepath))
             print(self.df.head())
             group = input('\nPlease enter group name: ')
-        else:
-            group = group.split('.')[0].strip(' {}'.format(group_type)) \
-                .split('the ')[-1].replace(' ', '_').replace('/', '').lower()
+
+            # Remember the answer for later runs
+            group_map['files'][catalog.hash_file(self.filepath)] = group
+            save_group_map(group_map)
 
         return group
         
@@ -111,18 +282,19 @@ class Dataset:
         self.df.rename(index=str, columns=self.renamed_cols, inplace=True)
 
         if 'payroll_number' in self.df.columns:
-            self.df['payroll_number'] = self.df['payroll_number'] \
-            .astype(str).apply('{0:0>6}'.format)
+            self.df['payroll_number'] = df_utils.pad_keys(self.df['payroll_number'])
         else:
             self.df['payroll_number'] = self.df['employee_name'].str[1:7]
 
+        df_utils.normalize_text_columns(self.df, keep_other=True)
+
         if 'role_date' in self.df.columns:
-            self.df['role_date'] = pd.to_datetime(self.df['role_date'])
+            self.df['role_date'] = date_utils.parse_dates(self.df['role_date'],
+                                                          report=self.df_type)
 
 
 def format_employee_list(df):
-    df[['last_name', 'first_name']] = df['employee_name'] \
-        .apply(lambda x: pd.Series(x.split(', ')))
+    df[['last_name', 'first_name']] = df_utils.split_names(df['employee_name'])
     
     if 'position' not in df.columns:
         df['position'] = np.nan
@@ -132,17 +304,44 @@ def format_employee_list(df):
     return df
 
 
-def add_role_dates(df_emp, df_role):
+def latest_role_dates(df_role):
     df_role = df_role[['payroll_number', 'role_date']]
+    return df_utils.latest_per_key(df_role, order_by=['role_date'],
+                                   name='role dates')
+
+
+def add_role_dates(df_emp, df_role):
+    df_role = latest_role_dates(df_role)
     df = pd.merge(df_emp, df_role, how='left', on='payroll_number')
 
     return df
 
 
-def add_performance(df_main, df_perf):
+def latest_performance(df_perf):
+    # Reviews without a score would hide the employee's last scored one
+    df_perf = df_perf.dropna(subset=['competency_score'])
+
+    # Review titles start with the review year, as in employee.py. Titles
+    # without one sort first.
+    year = df_perf['review_title'].astype(str).str[:4]
+    df_perf = df_perf.assign(competency_year=pd.to_numeric(year, errors='coerce'))
+    df_perf = df_utils.latest_per_key(df_perf, order_by=['competency_year'],
+                                      name='performance')
     df_perf = df_perf[['payroll_number', 'competency_score']]
     df_perf.reset_index(drop=True, inplace=True)
 
+    return df_perf
+
+
+def add_performance(df_main, df_perf):
+    return merge_performance(df_main, latest_performance(df_perf))
+
+
+def merge_performance(df_main, df_perf):
+    """
+    Joins the scores of latest_performance, leaving out those of employees
+    whose role started after October 1st of last year
+    """
     df_perf = pd.merge(df_main, df_perf, how='left', on='payroll_number')
     year = pd.Timestamp.now().year
     perf_date = pd.Timestamp(year=year - 1, month=10, day=1)
@@ -155,16 +354,16 @@ def add_performance(df_main, df_perf):
     return df
 
 
-def add_attendance_from_leave_taken(df_main, df_att):
+def leave_taken_points(df_att, df_roles):
+    """
+    Totals the leave taken points of each employee since their current role
+    date, given by df_roles
+    """
     df_att = df_att[['payroll_number', 'date', 'actual_leave']]
-    df_att = pd.merge(df_att, df_main, how='left', on='payroll_number')
 
-    df_att['payroll_number'].fillna(method='ffill', inplace=True)
-
-    df_att['date'] = pd.to_datetime(df_att['date'])
-    df_att['role_date'] = pd.to_datetime(df_att['role_date'])
-
-    df_att = df_att[df_att['date'] >= df_att['role_date']]
+    # Keep only leave taken since the employee's current role date
+    df_att = df_utils.match_role_dates(df_att, df_roles,
+                                       report=ReportType.LEAVE_TAKEN)
 
     df_att['points'] = df_att['actual_leave'].str.split('-') \
         .str[-1].str.strip(' ')
@@ -178,13 +377,24 @@ def add_attendance_from_leave_taken(df_main, df_att):
     df_point_totals = df_att[['payroll_number', 'points']] \
         .groupby(['payroll_number']).sum().reset_index()
 
+    return df_point_totals
+
+
+def add_attendance_from_leave_taken(df_main, df_att):
+    df_point_totals = leave_taken_points(df_att, df_main)
+
     df = pd.merge(df_main, df_point_totals, how='left', on='payroll_number')
 
     return df
 
 
-def add_total_points(df_main, df_att):
+def latest_total_points(df_att):
     df_att = df_att[['payroll_number', 'points']]
+    return df_utils.latest_per_key(df_att, name='leave entitlement')
+
+
+def add_total_points(df_main, df_att):
+    df_att = latest_total_points(df_att)
     df = pd.merge(df_main, df_att, on='payroll_number', how='left')
     if 'points_x' in df.columns:
         df['points'] = df['points_y']
@@ -196,16 +406,25 @@ def add_total_points(df_main, df_att):
 
 def get_employee_data(df_emp, df_att_lt, df_att_pts, df_role, df_perf):
 
-    df = format_employee_list(df_emp)
-    df = add_role_dates(df, df_role)
-    df = add_performance(df, df_perf)
+    with mem_profile.stage('format_employee_list'):
+        df = format_employee_list(df_emp)
+    with mem_profile.stage('add_role_dates'):
+        df = add_role_dates(df, df_role)
+    with mem_profile.stage('add_performance'):
+        df = add_performance(df, df_perf)
     if not df_att_lt.empty:
-        df = add_attendance_from_leave_taken(df, df_att_lt)
+        with mem_profile.stage('add_attendance_from_leave_taken'):
+            df = add_attendance_from_leave_taken(df, df_att_lt)
     if not df_att_pts.empty:
-        df = add_total_points(df, df_att_pts)
+        with mem_profile.stage('add_total_points'):
+            df = add_total_points(df, df_att_pts)
+
+    return fill_employee_data(df)
+
 
+def fill_employee_data(df):
     df['role_date'].fillna(pd.Timestamp(0), inplace=True)
     df.fillna(0, inplace=True)
-    df['role_date'] = pd.to_datetime(df['role_date'])
+    df['role_date'] = date_utils.parse_dates(df['role_date'])
 
     return df
\ No newline at end of file
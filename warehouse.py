@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+import pandas as pd
+import catalog, date_utils, file_utils, report_type
+import json, os, sqlite3
+import datetime as dt
+
+# Current working directory
+CUR_DIR = os.getcwd()
+
+WAREHOUSE_FILE = CUR_DIR + '/warehouse.db'
+
+# vr.Dataset calls the demographics report 'role_date'; both are kept in the
+# same table
+TABLES = {'role_date': 'demographics'}
+
+# SQLite limits the number of bound parameters in a single query
+MAX_PARAMS = 500
+
+# Group to query for snapshots stored without one, such as the full
+# employee list employee.py loads, as opposed to rank.py's group lists
+UNGROUPED = ''
+
+# Columns converted back to datetimes when read from the warehouse
+DATE_COLUMNS = ['role_date', 'date', 'termination_date', 'hire_date']
+
+
+def _quote(name):
+    return '"{}"'.format(str(name).replace('"', '""'))
+
+
+def _to_date_str(date):
+    return pd.Timestamp(date).strftime('%Y-%m-%d')
+
+
+def store_datasets(datasets, path=WAREHOUSE_FILE):
+    """
+    Appends every identified Dataset to the warehouse, skipping files that
+    are already stored
+    """
+    wh = Warehouse(path)
+    for ds in datasets:
+        if ds.df_type is None:
+            continue
+        # Group lists whose group is unknown, such as quarantined ones,
+        # would be taken for the full employee list
+        if ds.df_type == report_type.Report_Type.EMPLOYEE_LIST and \
+                getattr(ds, 'df_group', UNGROUPED) is None:
+            continue
+        wh.add_dataset(ds)
+    wh.close()
+
+
+class Warehouse:
+    """
+    File-based SQLite store of every dataset snapshot that has been loaded.
+
+    Each report type has its own table holding the rows of all of its
+    snapshots, tagged with snapshot_id and snapshot_date and indexed on
+    payroll_number and snapshot_date. The snapshots table records the source
+    file, its hash, report type, group and snapshot date; a file whose hash
+    is already recorded is not stored again.
+    """
+
+    def __init__(self, path=WAREHOUSE_FILE):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS snapshots (
+                                 snapshot_id INTEGER PRIMARY KEY,
+                                 hash TEXT UNIQUE,
+                                 path TEXT,
+                                 report_type TEXT,
+                                 group_name TEXT,
+                                 snapshot_date TEXT,
+                                 columns TEXT)''')
+        self.conn.execute('''CREATE INDEX IF NOT EXISTS snapshots_type_date
+                             ON snapshots (report_type, snapshot_date)''')
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def _table(self, report_type):
+        return TABLES.get(report_type, report_type)
+
+    def _columns(self, table):
+        rows = self.conn.execute('PRAGMA table_info({})'.format(_quote(table)))
+        return [row[1] for row in rows]
+
+    def _prepare_table(self, table, df):
+        columns = self._columns(table)
+        if not columns:
+            return
+
+        for column in df.columns:
+            if column not in columns:
+                self.conn.execute('ALTER TABLE {} ADD COLUMN {}'
+                                  .format(_quote(table), _quote(column)))
+
+    def _create_indexes(self, table):
+        for column in ['payroll_number', 'snapshot_date']:
+            self.conn.execute('CREATE INDEX IF NOT EXISTS {} ON {} ({})'
+                              .format(_quote(table + '_' + column),
+                                      _quote(table), _quote(column)))
+
+    def has_snapshot(self, file_hash):
+        row = self.conn.execute('SELECT 1 FROM snapshots WHERE hash = ?',
+                                (file_hash,)).fetchone()
+        return row is not None
+
+    def add_snapshot(self, df, report_type, snapshot_date, path=None,
+                     file_hash=None, group=None):
+        """
+        Appends a dataset snapshot to the warehouse
+
+        Args:
+            (pandas.DataFrame) df - formatted dataset
+            (str) report_type - report type of the dataset
+            (date) snapshot_date - date the export was taken
+            (str) path - source file of the dataset
+            (str) file_hash - hash of the source file, used to skip
+                  snapshots that are already stored
+            (str) group - employee list group, if any
+        Returns:
+            int - snapshot id, or None if the snapshot was already stored
+        """
+        if file_hash is not None and self.has_snapshot(file_hash):
+            return None
+
+        snapshot_date = _to_date_str(snapshot_date)
+        table = self._table(report_type)
+
+        df = df.loc[:, ~df.columns.duplicated()].copy()
+        columns = json.dumps([str(c) for c in df.columns])
+
+        cur = self.conn.execute('''INSERT INTO snapshots
+                                   (hash, path, report_type, group_name,
+                                    snapshot_date, columns)
+                                   VALUES (?, ?, ?, ?, ?, ?)''',
+                                (file_hash, path, report_type, group or None,
+                                 snapshot_date, columns))
+        snapshot_id = cur.lastrowid
+
+        df.insert(0, 'snapshot_date', snapshot_date)
+        df.insert(0, 'snapshot_id', snapshot_id)
+
+        self._prepare_table(table, df)
+        df.to_sql(table, self.conn, if_exists='append', index=False)
+        self._create_indexes(table)
+        self.conn.commit()
+
+        return snapshot_id
+
+    def add_dataset(self, ds, snapshot_date=None):
+        """
+        Appends a loaded Dataset to the warehouse. The snapshot date
+        defaults to the dataset's own, the date in the file name, then the
+        file's mtime.
+        """
+        if snapshot_date is None:
+            snapshot_date = getattr(ds, 'snapshot_date', None)
+        if snapshot_date is None:
+            snapshot_date = file_utils.get_file_date(ds.filepath)
+        if snapshot_date is None:
+            snapshot_date = dt.date.fromtimestamp(file_utils.stat_data(ds.filepath).st_mtime)
+
+        return self.add_snapshot(ds.df, ds.df_type, snapshot_date,
+                                 path=ds.filepath,
+                                 file_hash=catalog.hash_file(ds.filepath),
+                                 group=getattr(ds, 'df_group', None))
+
+    def snapshots(self, report_type, as_of=None, group=None):
+        """
+        Lists the snapshots of a report type taken on or before a date
+
+        Args:
+            (str) report_type - report type to list
+            (date) as_of - latest snapshot date to include, all if None
+            (str) group - group to match, UNGROUPED for snapshots without a
+                  group, all snapshots if None
+        Returns:
+            pandas.DataFrame - one row per snapshot, oldest first
+        """
+        types = [t for t, table in TABLES.items()
+                 if table == self._table(report_type)]
+        types = list(set(types + [report_type, self._table(report_type)]))
+
+        query = 'SELECT * FROM snapshots WHERE report_type IN ({})' \
+            .format(', '.join('?' * len(types)))
+        params = list(types)
+
+        if as_of is not None:
+            query += ' AND snapshot_date <= ?'
+            params.append(_to_date_str(as_of))
+        if group == UNGROUPED:
+            query += ' AND group_name IS NULL'
+        elif group is not None:
+            query += ' AND group_name = ?'
+            params.append(group)
+
+        query += ' ORDER BY snapshot_date, snapshot_id'
+
+        return pd.read_sql_query(query, self.conn, params=params)
+
+    def _read(self, table, where, params, columns=None, order_by='rowid'):
+        select = '*'
+        if columns is not None:
+            select = ', '.join(_quote(c) for c in columns)
+        # Rows come back in the order they were stored, which callers rely
+        # on to find the latest row of each employee
+        query = 'SELECT {} FROM {} WHERE {} ORDER BY {}'.format(
+            select, _quote(table), where, order_by)
+        df = pd.read_sql_query(query, self.conn, params=params)
+
+        date_utils.parse_columns(df, 'warehouse', DATE_COLUMNS)
+
+        return df
+
+    def _snapshot_columns(self, snaps):
+        columns = []
+        for cols in snaps['columns']:
+            columns.extend(c for c in json.loads(cols) if c not in columns)
+        return columns
+
+    def load_snapshot(self, report_type, snapshot_id):
+        snap = self.conn.execute('SELECT columns FROM snapshots '
+                                 'WHERE snapshot_id = ?',
+                                 (int(snapshot_id),)).fetchone()
+        return self._read(self._table(report_type), 'snapshot_id = ?',
+                          [int(snapshot_id)], json.loads(snap[0]))
+
+    def as_of(self, report_type, date, group=None, latest_only=True):
+        """
+        Returns a report as it was known on a given date
+
+        Args:
+            (str) report_type - report type to load
+            (date) date - point in time of the query
+            (str) group - employee list group, UNGROUPED for snapshots
+                  without a group, all snapshots if None
+            (bool) latest_only - return only the newest snapshot on or
+                   before date. If False, all such snapshots are appended,
+                   oldest first.
+        Returns:
+            pandas.DataFrame - dataset rows, empty if no snapshot exists
+        """
+        snaps = self.snapshots(report_type, as_of=date, group=group)
+        if snaps.empty:
+            return pd.DataFrame()
+
+        if latest_only:
+            return self.load_snapshot(report_type,
+                                      snaps['snapshot_id'].iloc[-1])
+
+        ids = snaps['snapshot_id'].astype(int).tolist()
+        return self._read(self._table(report_type),
+                          'snapshot_id IN ({})'.format(', '.join('?' * len(ids))),
+                          ids, self._snapshot_columns(snaps),
+                          order_by='snapshot_date, rowid')
+
+    def groups(self, report_type, date):
+        """
+        Returns the groups with a snapshot of a report type on or before date
+        """
+        snaps = self.snapshots(report_type, as_of=date)
+        return snaps['group_name'].dropna().unique().tolist()
+
+    def history(self, report_type, payroll_numbers, start=None, end=None):
+        """
+        Returns every stored row of a report for the given employees
+
+        Args:
+            (str) report_type - report type to load
+            (list) payroll_numbers - employees to look up
+            (date) start - earliest snapshot date, unbounded if None
+            (date) end - latest snapshot date, unbounded if None
+        Returns:
+            pandas.DataFrame - matching rows with their snapshot_date
+        """
+        table = self._table(report_type)
+        if not self._columns(table):
+            return pd.DataFrame()
+
+        where = ''
+        params = []
+        if start is not None:
+            where += ' AND snapshot_date >= ?'
+            params.append(_to_date_str(start))
+        if end is not None:
+            where += ' AND snapshot_date <= ?'
+            params.append(_to_date_str(end))
+
+        payroll_numbers = list(payroll_numbers)
+        dfs = []
+        for i in range(0, len(payroll_numbers), MAX_PARAMS):
+            chunk = payroll_numbers[i:i + MAX_PARAMS]
+            chunk_where = 'payroll_number IN ({})'.format(
+                ', '.join('?' * len(chunk))) + where
+            dfs.append(self._read(table, chunk_where, chunk + params))
+
+        if not dfs:
+            return pd.DataFrame()
+
+        df = pd.concat(dfs, ignore_index=True, sort=False)
+        df['snapshot_date'] = pd.to_datetime(df['snapshot_date'])
+        return df.sort_values(by=['payroll_number', 'snapshot_date'])
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+import pandas as pd
+import numpy as np
+import file_utils, rank, vr
+import itertools, os, time
+
+# Current working directory
+CURRENT_DIR = os.getcwd()
+
+# Output directory - change to desired location
+OUTPUT_DIR = CURRENT_DIR + '/output/whatif/'
+
+# Weights used by rank.calculate_rank: eval, attendance, role date
+BASELINE = (0.7, 0.2, 0.1)
+
+WEIGHT_COLS = ['eval_pct', 'att_pct', 'role_pct']
+
+
+def weight_grid(step=0.05):
+    """
+    Builds every combination of eval, attendance and role date weights in
+    increments of step that adds up to 1
+
+    Args:
+        (float) step - weight increment
+    Returns:
+        numpy.ndarray - one row of (eval, att, role) weights per set
+    """
+    steps = int(round(1 / step))
+    weights = [(e, a, steps - e - a)
+               for e, a in itertools.product(range(steps + 1), repeat=2)
+               if e + a <= steps]
+
+    return np.array(weights, dtype=float) / steps
+
+
+def _ranks(scores):
+    """
+    Ranks each row of a score matrix, highest score first. Ties keep the
+    employees' input order.
+    """
+    order = np.argsort(-scores, axis=1, kind='mergesort')
+    ranks = np.empty_like(order)
+    rows = np.arange(scores.shape[0])[:, None]
+    ranks[rows, order] = np.arange(1, scores.shape[1] + 1)
+
+    return ranks
+
+
+def rank_weight_sets(df, weights, baseline=BASELINE):
+    """
+    Ranks a group's employees under many weight sets at once.
+
+    Only employees with an eval score are ranked by rank_scaled; the other
+    two tiers are ordered by seniority and attendance and do not depend on
+    the weights, so they are left out.
+
+    Args:
+        (pandas.DataFrame) df - employee data from vr.get_employee_data
+        (array) weights - (eval, att, role) weights, one row per set
+        (tuple) baseline - weights the moves are measured against
+    Returns:
+        summary - Pandas DataFrame with one row per weight set and its
+                  rank stability metrics against the baseline
+        ranks - Pandas DataFrame of ranks, one row per employee and one
+                column per weight set
+    """
+    df = rank.scale_scores(df.copy())
+    df_score = rank.split_tiers(df)[0]
+
+    weights = np.asarray(weights, dtype=float).reshape(-1, 3)
+    scaled = df_score[['perf_scaled', 'att_scaled', 'role_scaled']].values
+
+    # (sets x employees) matrix of rank_scaled values
+    scores = weights.dot(scaled.T)
+    ranks = _ranks(scores)
+
+    base_scores = np.asarray(baseline, dtype=float).dot(scaled.T)
+    base_ranks = _ranks(base_scores[None, :])[0]
+
+    moves = np.abs(ranks - base_ranks)
+    n = scaled.shape[0]
+
+    summary = pd.DataFrame(weights, columns=WEIGHT_COLS)
+    summary['employees'] = n
+    summary['moved'] = (moves != 0).sum(axis=1)
+    summary['mean_move'] = moves.mean(axis=1) if n else 0.0
+    summary['max_move'] = moves.max(axis=1) if n else 0
+    if n > 1:
+        summary['spearman'] = 1 - 6 * (moves.astype(float) ** 2).sum(axis=1) \
+            / (n * (n ** 2 - 1))
+    else:
+        summary['spearman'] = 1.0
+
+    ranks = pd.DataFrame(ranks.T, index=df_score['payroll_number'].values,
+                         columns=['set_{}'.format(i) for i in range(len(weights))])
+    ranks.index.name = 'payroll_number'
+    ranks.insert(0, 'baseline', base_ranks)
+
+    return summary, ranks
+
+
+if __name__ == '__main__':
+    file_utils.create_dir(OUTPUT_DIR)
+
+    df_perf, df_role, df_att_lt, df_att_pts, groups = rank.load_files()
+
+    weights = weight_grid()
+
+    for df_emp, group_name in groups:
+        print('\n\nEvaluating {} weight sets for {}\n'.format(len(weights), group_name))
+        start_time = time.time()
+
+        df = vr.get_employee_data(df_emp, df_att_lt, df_att_pts, df_role, df_perf)
+
+        summary, ranks = rank_weight_sets(df, weights)
+
+        print(summary.sort_values(by=['moved', 'mean_move']).head())
+
+        filename = OUTPUT_DIR + pd.Timestamp.now().strftime('%Y%m%d%H%M') + \
+            '_' + group_name
+
+        summary.to_csv(filename + '_whatif_summary.csv', index=False)
+        ranks.to_csv(filename + '_whatif_ranks.csv')
+
+        print("\nWeight set evaluation took {} seconds.".format(time.time() - start_time))